@@ -1,16 +1,41 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, has_request_context, request, jsonify
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request, decode_token
 from werkzeug.security import generate_password_hash, check_password_hash  # noqa: F401 (kept for compatibility if referenced elsewhere)
 import os
+import sys
+import atexit
 import base64
+import csv
+import glob
+import hashlib
+import io
 import json
-from datetime import datetime, timedelta
-from uuid import UUID
+import asyncio
+import mmap
+import socket
+import struct
+import tempfile
+import zlib
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from urllib.parse import parse_qs
+from uuid import UUID, uuid4
 from dotenv import load_dotenv
 import string
 import random
+import httpx
+try:
+    import fcntl
+except ImportError:  # Windows: single-process journal without orphan recovery
+    fcntl = None
 from supabase import create_client, Client
+from supabase.lib.client_options import SyncClientOptions
 
 # Load environment variables
 load_dotenv()
@@ -22,9 +47,19 @@ app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'dev-secret-key-chang
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=30)
 jwt = JWTManager(app)
 
+@jwt.token_verification_loader
+def _reject_stream_tokens(jwt_header, jwt_data):
+    # Stream tokens travel in URLs, so they open /api/stream and nothing else
+    return jwt_data.get('scope') != 'stream'
+
+@jwt.token_verification_failed_loader
+def _stream_token_refused(jwt_header, jwt_data):
+    return create_error_response("Stream tokens are only valid for /api/stream", 401)
+
 # Configure CORS - allow all origins for API Gateway (restrict in production)
 FRONTEND_URL = os.getenv('FRONTEND_URL', '*')
-CORS(app, origins=['*'], supports_credentials=True)
+# The browser client reads Idempotent-Replayed to stop retrying a stored failure
+CORS(app, origins=['*'], supports_credentials=True, expose_headers=['Idempotent-Replayed', 'Retry-After'])
 
 # Supabase Configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL')
@@ -58,9 +93,18 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 else:
     print(f"SUPABASE_KEY present. Detected service_role: {IS_SERVICE_ROLE}")
 
+# Upstream time budgets: whole request, any single call, and when to fire a hedged duplicate read (0 = off)
+UPSTREAM_DEADLINE_SECONDS = float(os.getenv('UPSTREAM_DEADLINE_SECONDS', '10'))
+UPSTREAM_CALL_TIMEOUT_SECONDS = float(os.getenv('UPSTREAM_CALL_TIMEOUT_SECONDS', '5'))
+UPSTREAM_HEDGE_AFTER_SECONDS = float(os.getenv('UPSTREAM_HEDGE_AFTER_SECONDS', '0'))
+
 # create supabase client (use SUPABASE_KEY which may be service role)
 try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
+    # The HTTP timeout frees worker threads that outlive the deadline they were started under
+    supabase: Client = create_client(
+        SUPABASE_URL, SUPABASE_KEY,
+        options=SyncClientOptions(postgrest_client_timeout=UPSTREAM_CALL_TIMEOUT_SECONDS)
+    ) if SUPABASE_URL and SUPABASE_KEY else None
 except Exception as e:
     print(f"Failed to create Supabase client: {e}")
     supabase = None
@@ -145,13 +189,1503 @@ def create_error_response(message, code=400):
         "timestamp": datetime.now().isoformat()
     }), code
 
+class _Metrics:
+    """Process-local counters exposed on /api/metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+_metrics = _Metrics()
+
+# Upstream protection: per-request deadlines, a circuit breaker per upstream, optional hedged reads
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_SECONDS = float(os.getenv('BREAKER_RESET_SECONDS', '30'))
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '32'))
+# Global gate on in-flight upstream calls; callers that cannot get a slot quickly are shed with 503
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', '16'))
+UPSTREAM_ADMISSION_WAIT_SECONDS = float(os.getenv('UPSTREAM_ADMISSION_WAIT_SECONDS', '0.05'))
+
+class UpstreamUnavailable(Exception):
+    """An upstream call was refused or abandoned; surfaced to clients as 503 with Retry-After."""
+
+    def __init__(self, upstream, reason, retry_after=1):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+class _CircuitBreaker:
+    """Opens after consecutive failures, then lets a single probe through once the cool-down passes."""
+
+    def __init__(self, name, threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_seconds:
+                return False
+            self._probing = True
+            return True
+
+    def is_open(self):
+        return self._opened_at is not None
+
+    def retry_after(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 1
+            return max(1, self.reset_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                if self._opened_at is None or self._probing:
+                    print(f"Circuit breaker opened for {self.name}")
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+_breakers = {name: _CircuitBreaker(name) for name in ('postgrest', 'auth', 'auth_admin')}
+_upstream_pool = ThreadPoolExecutor(max_workers=UPSTREAM_POOL_SIZE, thread_name_prefix='upstream')
+_upstream_slots = threading.BoundedSemaphore(UPSTREAM_MAX_CONCURRENCY)
+
+@app.before_request
+def _start_request_deadline():
+    g.deadline = time.monotonic() + UPSTREAM_DEADLINE_SECONDS
+
+def _deadline_remaining(call_timeout=None):
+    """Seconds left for upstream work; outside a request (e.g. streaming generators) each call gets the per-call cap.
+
+    call_timeout replaces UPSTREAM_CALL_TIMEOUT_SECONDS as the cap for calls known to run long.
+    """
+    cap = call_timeout or UPSTREAM_CALL_TIMEOUT_SECONDS
+    if has_request_context() and 'deadline' in g:
+        return min(g.deadline - time.monotonic(), cap)
+    return cap
+
+def _request_time_left():
+    """Seconds until the request deadline, uncapped; for waiting on work another caller started."""
+    if has_request_context() and 'deadline' in g:
+        return g.deadline - time.monotonic()
+    return UPSTREAM_CALL_TIMEOUT_SECONDS
+
+def _submit_upstream(fn):
+    """Start fn on the upstream pool; the caller's admission slot is held until it really finishes."""
+    _metrics.incr('upstream.in_flight')
+    attempt = _upstream_pool.submit(fn)
+
+    def finished(_):
+        _metrics.incr('upstream.in_flight', -1)
+        _upstream_slots.release()
+
+    attempt.add_done_callback(finished)
+    return attempt
+
+def _call_upstream(upstream, fn, hedge=False, timeout=None):
+    """Run fn against an upstream within the remaining deadline, guarded by that upstream's breaker.
+
+    With hedge=True (idempotent reads only) a duplicate attempt is started if the first has not
+    answered after UPSTREAM_HEDGE_AFTER_SECONDS, and whichever finishes first wins.
+    Only timeouts and transport errors count against the breaker; an error response still
+    proves the upstream is answering. timeout overrides the per-call cap (see _deadline_remaining).
+    """
+    breaker = _breakers[upstream]
+    budget = _deadline_remaining(timeout)
+    if budget <= 0:
+        _metrics.incr('upstream.deadline_exceeded')
+        raise UpstreamUnavailable(upstream, "request deadline exceeded")
+    if not _upstream_slots.acquire(timeout=min(budget, UPSTREAM_ADMISSION_WAIT_SECONDS)):
+        _metrics.incr('upstream.shed')
+        raise UpstreamUnavailable(upstream, "overloaded")
+    if not breaker.allow():
+        _upstream_slots.release()
+        _metrics.incr(f'upstream.{upstream}.circuit_open')
+        raise UpstreamUnavailable(upstream, "circuit open", breaker.retry_after())
+
+    deadline = time.monotonic() + budget
+    attempts = [_submit_upstream(fn)]
+    # A hedge needs its own slot; under pressure it is simply skipped
+    if hedge and 0 < UPSTREAM_HEDGE_AFTER_SECONDS < budget:
+        done, _ = wait(attempts, timeout=UPSTREAM_HEDGE_AFTER_SECONDS)
+        if not done and _upstream_slots.acquire(blocking=False):
+            _metrics.incr('upstream.hedged')
+            attempts.append(_submit_upstream(fn))
+
+    pending = set(attempts)
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for attempt in done:
+            exc = attempt.exception()
+            if exc is None:
+                breaker.record_success()
+                return attempt.result()
+            error = exc
+
+    if error is not None and not isinstance(error, (httpx.TransportError, TimeoutError)):
+        breaker.record_success()
+        raise error
+    breaker.record_failure()
+    _metrics.incr(f'upstream.{upstream}.failures')
+    reason = "timed out" if error is None else f"transport error: {error}"
+    raise UpstreamUnavailable(upstream, reason, breaker.retry_after())
+
+def _execute(query, hedge=False, timeout=None):
+    """Execute a PostgREST query builder through _call_upstream; pass hedge=True only for reads.
+
+    timeout lets one call run past UPSTREAM_CALL_TIMEOUT_SECONDS, HTTP timeout included; the
+    request deadline still applies, so the handler has to extend g.deadline as well.
+    """
+    if has_request_context() and _is_write(query):
+        # Once sent, a write may land even if we stop waiting for it (see idempotent)
+        g.upstream_writes = True
+    if timeout:
+        _use_http_timeout(query, timeout)
+    return _call_upstream('postgrest', query.execute, hedge=hedge, timeout=timeout)
+
+_long_sessions = {}
+_long_sessions_lock = threading.Lock()
+
+def _use_http_timeout(query, timeout):
+    """Send query through a copy of its HTTP session with the given timeout.
+
+    postgrest has no per-request timeout, and the shared session's must stay at the per-call cap.
+    """
+    request = getattr(query, 'request', None)
+    session = getattr(request, 'session', None)
+    if not isinstance(session, httpx.Client):
+        return
+    key = (str(session.base_url), timeout)
+    with _long_sessions_lock:
+        long_session = _long_sessions.get(key)
+        if long_session is None:
+            long_session = _long_sessions[key] = httpx.Client(
+                base_url=session.base_url, timeout=timeout, follow_redirects=session.follow_redirects)
+    # The session's current headers (apikey, Authorization) travel with the request
+    for name, value in session.headers.items():
+        request.headers.setdefault(name, value)
+    request.session = long_session
+
+def _is_write(query):
+    """Anything but a GET/HEAD builder, including RPCs and builders we cannot inspect."""
+    method = str(getattr(getattr(query, 'request', None), 'http_method', 'POST'))
+    return not method.endswith(('GET', 'HEAD'))
+
+def _upstream_unavailable_response(e):
+    print(f"Upstream unavailable: {e}")
+    resp, code = create_error_response("Service temporarily unavailable, please retry", 503)
+    resp.headers['Retry-After'] = str(e.retry_after)
+    return resp, code
+
+# Per-key token buckets for write endpoints: (refill per second, burst) per policy
+RATE_LIMITS = {
+    'round': (float(os.getenv('RATE_LIMIT_ROUND_PER_SECOND', '2')), int(os.getenv('RATE_LIMIT_ROUND_BURST', '10'))),
+    'points': (float(os.getenv('RATE_LIMIT_POINTS_PER_SECOND', '2')), int(os.getenv('RATE_LIMIT_POINTS_BURST', '10'))),
+    'login': (float(os.getenv('RATE_LIMIT_LOGIN_PER_SECOND', '0.2')), int(os.getenv('RATE_LIMIT_LOGIN_BURST', '5'))),
+    'export': (float(os.getenv('RATE_LIMIT_EXPORT_PER_SECOND', '0.05')), int(os.getenv('RATE_LIMIT_EXPORT_BURST', '3'))),
+}
+# Many users can share an IP (NAT, mobile carriers), so IP buckets get a larger allowance
+RATE_LIMIT_IP_FACTOR = float(os.getenv('RATE_LIMIT_IP_FACTOR', '5'))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+TRUST_PROXY_HEADERS = os.getenv('TRUST_PROXY_HEADERS', '').lower() in ('1', 'true', 'yes')
+
+class _TokenBucketLimiter:
+    """Token buckets keyed by string, kept in least-recently-used order.
+
+    A bucket idle long enough to refill completely is indistinguishable from a new one, so those
+    are evicted from the cold end as new keys arrive; memory tracks recently active keys only.
+    """
+
+    def __init__(self, rate, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> [tokens, last_refill]
+
+    def acquire(self, key, take=True):
+        """Take one token for key; return (allowed, seconds until the next token).
+
+        take=False only checks that a token is available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            allowed = tokens >= 1
+            if allowed and take:
+                tokens -= 1
+            self._buckets[key] = [tokens, now]
+            self._buckets.move_to_end(key)
+            self._evict(now)
+        return allowed, 0 if allowed else (1 - tokens) / self.rate
+
+    def _evict(self, now):
+        while self._buckets:
+            oldest_key, (tokens, last) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_keys and tokens + (now - last) * self.rate < self.burst:
+                break
+            del self._buckets[oldest_key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+_rate_limiters = {
+    policy: (_TokenBucketLimiter(rate, burst), _TokenBucketLimiter(rate * RATE_LIMIT_IP_FACTOR, int(burst * RATE_LIMIT_IP_FACTOR)))
+    for policy, (rate, burst) in RATE_LIMITS.items()
+}
+
+def _client_ip():
+    if TRUST_PROXY_HEADERS and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or 'unknown'
+
+def _jwt_user_key():
+    return get_jwt_identity()
+
+def _login_user_key():
+    # Keyed on identifier and IP together: failed guesses from one address must not lock the
+    # account out for its owner elsewhere
+    data = request.get_json(silent=True) or {}
+    identifier = str(data.get('email') or data.get('username') or '').strip().lower()
+    return f"{identifier}|{_client_ip()}" if identifier else None
+
+def _status_code(response):
+    if isinstance(response, tuple):
+        return response[1]
+    return getattr(response, 'status_code', 200)
+
+def rate_limited(policy, user_key=_jwt_user_key, failures_only=False):
+    """Reject with 429 once the caller's user or IP bucket for this policy is empty.
+
+    With failures_only, the user bucket is only charged when the handler answers 401, so it
+    throttles wrong passwords rather than logins. Place below @jwt_required() so the identity is
+    already verified.
+    """
+    user_limiter, ip_limiter = _rate_limiters[policy]
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            checks = [('ip', ip_limiter, _client_ip())]
+            user = user_key()
+            if user:
+                checks.insert(0, ('user', user_limiter, user))
+            for scope, limiter, key in checks:
+                allowed, retry_after = limiter.acquire(key, take=not (failures_only and scope == 'user'))
+                if not allowed:
+                    _metrics.incr(f'rate_limited.{policy}.{scope}')
+                    resp, code = create_error_response("Too many requests - try again later", 429)
+                    resp.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+                    return resp, code
+            response = fn(*args, **kwargs)
+            if failures_only and user and _status_code(response) == 401:
+                user_limiter.acquire(user)
+            return response
+        return wrapper
+    return decorator
+
+# Admin endpoints: JWT identities listed in ADMIN_USER_IDS (comma-separated)
+ADMIN_USER_IDS = {uid.strip() for uid in os.getenv('ADMIN_USER_IDS', '').split(',') if uid.strip()}
+
+def _is_admin(user_id):
+    return bool(user_id) and user_id in ADMIN_USER_IDS
+
+def admin_required(fn):
+    """Reject non-admin callers with 403; place below @jwt_required()."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _is_admin(get_jwt_identity()):
+            return create_error_response("Admin access required", 403)
+        return fn(*args, **kwargs)
+    return wrapper
+
+# Idempotent writes: a repeated Idempotency-Key replays the first response instead of re-running
+# the handler. Completed keys live in a bounded per-worker LRU, backed by the idempotency_key
+# table (migrations/0001_idempotency_key.sql) whose primary key makes the claim unique across workers.
+IDEMPOTENCY_TABLE = 'idempotency_key'
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+# A pending claim older than this is assumed abandoned by a worker that crashed or could not
+# record the outcome. It may have written first, so the key answers "outcome unknown" from then on
+IDEMPOTENCY_PENDING_TIMEOUT_SECONDS = float(os.getenv('IDEMPOTENCY_PENDING_TIMEOUT_SECONDS', '60'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+class _IdempotencyStore:
+    """Claims and stored responses for (user_id, Idempotency-Key) pairs.
+
+    begin() returns one of ('run', None), ('replay', (code, body)), ('mismatch', None) when the key
+    was used for a different request, or ('pending', None) while the first attempt is still running.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (user_id, key) -> [expires_at, fingerprint, response or None]
+
+    def begin(self, user_id, key, fingerprint):
+        scope = (user_id, key)
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry and entry[0] < time.monotonic():
+                del self._entries[scope]
+                entry = None
+            if entry:
+                self._entries.move_to_end(scope)
+                if entry[1] != fingerprint:
+                    return 'mismatch', None
+                return ('replay', entry[2]) if entry[2] else ('pending', None)
+            self._remember(scope, fingerprint, None)
+
+        try:
+            state, response = self._claim_durable(user_id, key, fingerprint)
+        except BaseException:
+            self._forget_pending(scope)
+            raise
+        if state == 'replay':
+            with self._lock:
+                self._remember(scope, fingerprint, response)
+        elif state != 'run':
+            # The durable claim belongs to another worker; only drop ours
+            self._forget_pending(scope)
+        return state, response
+
+    def complete(self, user_id, key, fingerprint, code, body):
+        with self._lock:
+            self._remember((user_id, key), fingerprint, (code, body))
+        if not self._durable():
+            return
+        try:
+            _execute(supabase.table(IDEMPOTENCY_TABLE).update({
+                'status': 'completed',
+                'response_code': code,
+                'response_body': body,
+                'completed_at': datetime.now(timezone.utc).isoformat()
+            }).eq('user_id', user_id).eq('idempotency_key', key))
+        except Exception as e:
+            # The local entry still dedupes retries that reach this worker
+            _metrics.incr('idempotency.durable_errors')
+            print(f"Idempotency complete error: {e}")
+
+    def abandon(self, user_id, key):
+        """Release a claim whose handler failed so a retry runs again."""
+        self._forget_pending((user_id, key))
+        if not self._durable():
+            return
+        try:
+            _execute(supabase.table(IDEMPOTENCY_TABLE).delete()
+                     .eq('user_id', user_id).eq('idempotency_key', key).eq('status', 'pending'))
+        except Exception as e:
+            # Left pending, the key answers "outcome unknown" after IDEMPOTENCY_PENDING_TIMEOUT_SECONDS
+            print(f"Idempotency release error: {e}")
+
+    def _forget_pending(self, scope):
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry and entry[2] is None:
+                del self._entries[scope]
+
+    def _remember(self, scope, fingerprint, response):
+        self._entries[scope] = [time.monotonic() + self.ttl, fingerprint, response]
+        self._entries.move_to_end(scope)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _durable(self):
+        return bool(supabase and IS_SERVICE_ROLE)
+
+    def _claim_durable(self, user_id, key, fingerprint):
+        if not self._durable():
+            return 'run', None
+        table = supabase.table(IDEMPOTENCY_TABLE)
+        now = datetime.now(timezone.utc)
+        claim = {'user_id': user_id, 'idempotency_key': key, 'request_hash': fingerprint,
+                 'status': 'pending', 'created_at': now.isoformat()}
+        try:
+            _execute(table.insert(claim))
+            return 'run', None
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            if getattr(e, 'code', None) != '23505':
+                # Without the table (migration not applied) keys are only deduped per worker
+                _metrics.incr('idempotency.durable_errors')
+                print(f"Idempotency claim error: {e}")
+                return 'run', None
+
+        existing = _execute(supabase.table(IDEMPOTENCY_TABLE).select('*')
+                            .eq('user_id', user_id).eq('idempotency_key', key)).data
+        if not existing:
+            # Released between our insert and read; let the client retry
+            return 'pending', None
+        row = existing[0]
+        age = _seconds_since(row.get('created_at'), now)
+        expired = age is not None and age > self.ttl
+        if not expired and row.get('status') == 'completed':
+            if row.get('request_hash') != fingerprint:
+                return 'mismatch', None
+            return 'replay', (row.get('response_code') or 200, row.get('response_body'))
+        if row.get('request_hash') != fingerprint:
+            return 'mismatch', None
+        # Compare-and-set on the observed created_at so only one worker acts on the old claim
+        if expired:
+            taken = _execute(supabase.table(IDEMPOTENCY_TABLE).update(dict(claim, response_code=None, response_body=None, completed_at=None))
+                             .eq('user_id', user_id).eq('idempotency_key', key).eq('created_at', row['created_at'])).data
+            if taken:
+                return 'run', None
+        elif age is not None and age > IDEMPOTENCY_PENDING_TIMEOUT_SECONDS:
+            code, body = _outcome_unknown()
+            _execute(supabase.table(IDEMPOTENCY_TABLE).update({
+                'status': 'completed',
+                'response_code': code,
+                'response_body': body,
+                'completed_at': now.isoformat()
+            }).eq('user_id', user_id).eq('idempotency_key', key).eq('created_at', row['created_at']))
+            return 'replay', (code, body)
+        return 'pending', None
+
+def _seconds_since(timestamp, now):
+    try:
+        then = datetime.fromisoformat(str(timestamp))
+    except ValueError:
+        return None
+    if then.tzinfo is None:
+        then = then.replace(tzinfo=timezone.utc)
+    return (now - then).total_seconds()
+
+_idempotency = _IdempotencyStore(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_SECONDS)
+
+def _outcome_unknown():
+    """(code, body) kept for a key whose request failed after sending a write."""
+    _metrics.incr('idempotency.outcome_unknown')
+    resp, code = create_error_response(
+        "The request failed after it started saving and may have been applied; "
+        "refresh before trying again", 500)
+    return code, resp.get_json()
+
+def idempotent(fn):
+    """Honor an Idempotency-Key header: a repeat of the same request gets the stored response.
+
+    Place below @jwt_required() and @rate_limited; keys are scoped to the JWT identity. A failure
+    (status 500 and above) releases the key only if the handler had not yet sent a write, so a
+    retry runs it again. After a write was sent, a timed-out attempt may still land, so the key
+    keeps a 500 "outcome unknown" response instead and a retry cannot apply the write twice.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return fn(*args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return create_error_response("Idempotency-Key is too long", 400)
+
+        user_id = get_jwt_identity()
+        fingerprint = hashlib.sha256(b'\n'.join([request.method.encode(), request.path.encode(), request.get_data()])).hexdigest()
+        state, stored = _idempotency.begin(user_id, key, fingerprint)
+        if state == 'replay':
+            _metrics.incr('idempotency.replayed')
+            code, body = stored
+            resp = jsonify(body)
+            resp.status_code = code
+            resp.headers['Idempotent-Replayed'] = 'true'
+            return resp
+        if state == 'mismatch':
+            _metrics.incr('idempotency.mismatched')
+            return create_error_response("Idempotency-Key was already used for a different request", 422)
+        if state == 'pending':
+            _metrics.incr('idempotency.in_progress')
+            resp, code = create_error_response("A request with this Idempotency-Key is still in progress", 409)
+            resp.headers['Retry-After'] = '1'
+            return resp, code
+
+        g.upstream_writes = False
+        try:
+            resp = app.make_response(fn(*args, **kwargs))
+        except UpstreamUnavailable as e:
+            resp = app.make_response(_upstream_unavailable_response(e))
+        except BaseException:
+            g.deadline = time.monotonic() + UPSTREAM_CALL_TIMEOUT_SECONDS
+            if g.upstream_writes:
+                _idempotency.complete(user_id, key, fingerprint, *_outcome_unknown())
+            else:
+                _idempotency.abandon(user_id, key)
+            raise
+        # Recording the outcome gets its own budget; a timed-out handler has spent the request's
+        g.deadline = time.monotonic() + UPSTREAM_CALL_TIMEOUT_SECONDS
+        if resp.status_code >= 500 and not g.upstream_writes:
+            _idempotency.abandon(user_id, key)
+        else:
+            if resp.status_code >= 500:
+                code, body = _outcome_unknown()
+                resp = jsonify(body)
+                resp.status_code = code
+            _idempotency.complete(user_id, key, fingerprint, resp.status_code, resp.get_json(silent=True))
+        return resp
+    return wrapper
+
+class _DatabaseError(Exception):
+    """Raised by shared read helpers when supabase reports an error, so followers see it too."""
+
+# Shared read caching: short-lived results plus single-flight so a cold key costs one upstream query
+READ_CACHE_TTL_SECONDS = float(os.getenv('READ_CACHE_TTL_SECONDS', '5'))
+USERNAME_CACHE_TTL_SECONDS = float(os.getenv('USERNAME_CACHE_TTL_SECONDS', '300'))
+MAX_LEADERBOARD_LIMIT = 1000
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class _SingleFlight:
+    """Concurrent callers with the same key share one in-flight call and its result (or exception)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise UpstreamUnavailable(key[0], "timed out waiting for shared read")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+# Cross-worker cache tier: file-backed mmaps that every worker on the host maps, so one worker's
+# fetch serves all of them (SHARED_CACHE=0 keeps caches per worker)
+SHARED_CACHE = os.getenv('SHARED_CACHE', '1') != '0'
+SHARED_CACHE_DIR = os.getenv('SHARED_CACHE_DIR', tempfile.gettempdir())
+# Part of every shared file name, so deployments on one host (staging and production against
+# different projects) never map each other's files; set it to separate two apps on one project
+APP_INSTANCE_ID = os.getenv('APP_INSTANCE_ID') or hashlib.sha256((SUPABASE_URL or '').encode()).hexdigest()[:16]
+
+class _SharedStore:
+    """Fixed-size slots in a file-backed mmap, one per hash bucket of the key.
+
+    Each slot is a seqlock: a writer makes the sequence odd, writes, then makes it even again,
+    and a reader retries if the sequence was odd or moved while it copied (the payload CRC
+    catches anything the reordering of plain memory copies could let through). Writers are
+    serialized across processes by a byte-range lock on the slot. Values are stored as JSON;
+    values that do not encode or do not fit a slot stay in the worker-local tier only.
+    """
+    _HEADER = struct.Struct('<QdQII')  # seq, expires_at (wall clock), key hash, payload length, crc32
+
+    def __init__(self, path, slots, slot_bytes):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.size = slots * slot_bytes
+        self._locks = [threading.Lock() for _ in range(64)]
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < self.size:
+            os.ftruncate(self._fd, self.size)
+        self._map = mmap.mmap(self._fd, self.size)
+
+    @classmethod
+    def open(cls, name, slots, slot_bytes):
+        """The store for name, or None when it cannot be shared (disabled, no fcntl, unwritable dir)."""
+        if not SHARED_CACHE or not fcntl:
+            return None
+        try:
+            return cls(os.path.join(SHARED_CACHE_DIR, f'placebo-{APP_INSTANCE_ID}-{name}.bin'), slots, slot_bytes)
+        except OSError as e:
+            print(f"Shared cache {name} unavailable, caching per worker only: {e}")
+            return None
+
+    def _locate(self, key):
+        digest = hashlib.blake2b(json.dumps(key, separators=(',', ':')).encode(), digest_size=8).digest()
+        digest = struct.unpack('<Q', digest)[0]
+        return (digest % self.slots) * self.slot_bytes, digest
+
+    @contextmanager
+    def _file_lock(self, offset, timeout=None):
+        """Hold an fcntl lock on one byte at offset, waiting at most timeout if given; yields whether it was acquired.
+
+        fcntl locks are per process, so threads of one worker must be kept apart by other means.
+        """
+        if timeout is None:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+            acquired = True
+        else:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+                    acquired = True
+                    break
+                except OSError:
+                    if time.monotonic() >= deadline:
+                        acquired = False
+                        break
+                    time.sleep(0.005)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    def get(self, key):
+        """Return (hit, value, seconds until it expires)."""
+        offset, digest = self._locate(key)
+        start = offset + self._HEADER.size
+        for _ in range(4):
+            seq, expires_at, slot_digest, length, crc = self._HEADER.unpack_from(self._map, offset)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            remaining = expires_at - time.time()
+            if not seq or slot_digest != digest or remaining <= 0 or length > self.slot_bytes - self._HEADER.size:
+                return False, None, 0
+            payload = self._map[start:start + length]
+            if struct.unpack_from('<Q', self._map, offset)[0] != seq or zlib.crc32(payload) != crc:
+                continue
+            return True, json.loads(payload), remaining
+        return False, None, 0
+
+    def set(self, key, value, ttl):
+        try:
+            payload = json.dumps(value, separators=(',', ':')).encode()
+        except (TypeError, ValueError):
+            return
+        if len(payload) > self.slot_bytes - self._HEADER.size:
+            _metrics.incr('shared_cache.oversize')
+            return
+        offset, digest = self._locate(key)
+        self._write(offset, digest, payload, time.time() + ttl)
+
+    def discard(self, key):
+        offset, digest = self._locate(key)
+        if self._HEADER.unpack_from(self._map, offset)[2] == digest:
+            self._write(offset, digest, b'', 0)
+
+    def _write(self, offset, digest, payload, expires_at):
+        with self._locks[offset // self.slot_bytes % len(self._locks)], self._file_lock(offset):
+            seq = struct.unpack_from('<Q', self._map, offset)[0]
+            # An odd sequence here means a writer died mid-write; keep it odd and finish over it
+            seq |= 1
+            struct.pack_into('<Q', self._map, offset, seq)
+            start = offset + self._HEADER.size
+            self._map[start:start + len(payload)] = payload
+            self._HEADER.pack_into(self._map, offset, seq, expires_at, digest, len(payload), zlib.crc32(payload))
+            struct.pack_into('<Q', self._map, offset, seq + 1)
+
+    def fill_lock(self, key, timeout):
+        """Cross-worker lease on filling key's slot; waits at most timeout, then lets the caller fill anyway."""
+        offset, _ = self._locate(key)
+        # Lease locks live past the end of the file so they never contend with slot writers; within
+        # a worker, _shared_read's single-flight already admits one filler per key
+        return self._file_lock(self.size + offset // self.slot_bytes, timeout=timeout)
+
+class _TTLCache:
+    """Small LRU of values that expire after a fixed number of seconds.
+
+    With a shared store, misses fall through to it and sets write through to it, so workers on
+    the same host fill each key once between them.
+    """
+
+    def __init__(self, ttl, max_entries=1024, shared=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Return (hit, value)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    return True, value
+                del self._entries[key]
+        if self.shared:
+            hit, value, remaining = self.shared.get(key)
+            if hit:
+                _metrics.incr('shared_cache.hits')
+                self._store(key, value, time.monotonic() + remaining)
+                return True, value
+        return False, None
+
+    def set(self, key, value):
+        self._store(key, value, time.monotonic() + self.ttl)
+        if self.shared:
+            self.shared.set(key, value, self.ttl)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared:
+            self.shared.discard(key)
+
+    def fill_lock(self, key, timeout):
+        return self.shared.fill_lock(key, timeout) if self.shared else nullcontext(True)
+
+    def _store(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+_read_flights = _SingleFlight()
+# Leaderboard pages (up to MAX_LEADERBOARD_LIMIT rows) and game lists
+_read_cache = _TTLCache(READ_CACHE_TTL_SECONDS, shared=_SharedStore.open('read-cache', 128, 256 * 1024))
+_username_cache = _TTLCache(USERNAME_CACHE_TTL_SECONDS, max_entries=10000, shared=_SharedStore.open('usernames', 16384, 256))
+
+def _shared_read(key, fetch, cache=_read_cache):
+    """Serve key from cache, otherwise let exactly one caller run fetch() while identical callers wait.
+
+    Keys are tuples of route name and normalized parameters, e.g. ('users', 100).
+    Returned values are shared between requests and must be treated as read-only.
+    """
+    hit, value = cache.get(key)
+    if hit:
+        return value
+
+    def fill():
+        # A caller that lost the race to an earlier flight may find the value already cached
+        hit, value = cache.get(key)
+        if hit:
+            return value
+        # Other workers filling the same key are waited for briefly, then fetched alongside
+        with cache.fill_lock(key, timeout=max(0, min(READ_CACHE_TTL_SECONDS, _request_time_left()))):
+            hit, value = cache.get(key)
+            if hit:
+                return value
+            value = fetch()
+            cache.set(key, value)
+            return value
+
+    # Followers wait as long as their request may, not one call's cap: a fill can take several calls
+    return _read_flights.do(key, fill, timeout=max(0, _request_time_left()))
+
+def _auth_username(user_id):
+    """Username from auth user metadata, shared across requests for USERNAME_CACHE_TTL_SECONDS."""
+    def fetch():
+        auth_user = _call_upstream('auth_admin', lambda: supabase.auth.admin.get_user_by_id(user_id), hedge=True)
+        return auth_user.user.user_metadata.get('username', 'User')
+    return _shared_read(('username', user_id), fetch, cache=_username_cache)
+
+# Per-user profile cache: read-through on miss, write-through on balance changes, versioned across workers
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '10000'))
+# Upper bound on staleness for writes made outside this app (SQL console, triggers)
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv('PROFILE_CACHE_TTL_SECONDS', '60'))
+PROFILE_VERSION_FILE = os.getenv('PROFILE_VERSION_FILE', os.path.join(SHARED_CACHE_DIR, f'placebo-{APP_INSTANCE_ID}-profile-versions.bin'))
+PROFILE_VERSION_SLOTS = 65536
+
+class _ProfileVersions:
+    """Version stamps in a file-backed mmap, one 8-byte slot per hash bucket of user_id.
+
+    Every worker on the host maps the same file, so a write in one worker is visible to all
+    the others on their next lookup. Stamps are random rather than counters: two writers racing
+    can never move a slot back to a value some reader already cached.
+    """
+
+    def __init__(self, path, slots):
+        self.slots = slots
+        self._locks = [threading.Lock() for _ in range(64)]
+        size = slots * 8
+        try:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        except OSError as e:
+            print(f"Profile version file unavailable, cache coherence is per-process only: {e}")
+            self._fd = None
+            self._map = mmap.mmap(-1, size)
+
+    def _offset(self, user_id):
+        return (zlib.crc32(str(user_id).encode()) % self.slots) * 8
+
+    def current(self, user_id):
+        return struct.unpack_from('<Q', self._map, self._offset(user_id))[0]
+
+    def bump(self, user_id, expected=None):
+        """Stamp the slot with a fresh value and return it.
+
+        With expected, only stamp if the slot still holds it and return None otherwise (the
+        caller raced another writer). The compare-and-set is serialized across threads and,
+        through a byte-range lock on the file, across processes.
+        """
+        offset = self._offset(user_id)
+        # os.urandom, not random: forked workers share the random module's seed
+        stamp = struct.unpack('<Q', os.urandom(8))[0] | 1
+        with self._locks[offset // 8 % len(self._locks)]:
+            if self._fd is not None and fcntl:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, 8, offset)
+            try:
+                if expected is not None and struct.unpack_from('<Q', self._map, offset)[0] != expected:
+                    stamp = None
+                else:
+                    struct.pack_into('<Q', self._map, offset, stamp)
+            finally:
+                if self._fd is not None and fcntl:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, 8, offset)
+        return stamp
+
+class _ProfileCache:
+    """LRU of user_profile rows; an entry is served only while its version stamp is current."""
+
+    def __init__(self, versions, max_entries, ttl):
+        self.versions = versions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (stamp, expires_at, row)
+
+    def _store(self, user_id, stamp, row):
+        with self._lock:
+            self._entries[user_id] = (stamp, time.monotonic() + self.ttl, row)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, user_id, fetch):
+        """Return (row copy, stamp), calling fetch() on a miss."""
+        current = self.versions.current(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                stamp, expires_at, row = entry
+                if stamp == current and expires_at > time.monotonic():
+                    self._entries.move_to_end(user_id)
+                    _metrics.incr('profile_cache.hits')
+                    return dict(row), stamp
+                del self._entries[user_id]
+        _metrics.incr('profile_cache.misses')
+
+        def load():
+            # Read the stamp before the row: a write landing in between leaves us already stale
+            stamp = self.versions.current(user_id)
+            row = fetch()
+            self._store(user_id, stamp, row)
+            return row, stamp
+
+        row, stamp = _read_flights.do(('profile', user_id), load, timeout=max(0, _request_time_left()))
+        return dict(row), stamp
+
+    def write_through(self, user_id, read_stamp, row):
+        """Cache the row a write just committed, provided no other writer got in since read_stamp."""
+        stamp = self.versions.bump(user_id, expected=read_stamp)
+        if stamp is None:
+            _metrics.incr('profile_cache.write_races')
+            self.invalidate(user_id)
+            return
+        self._store(user_id, stamp, dict(row))
+
+    def invalidate(self, user_id):
+        self.versions.bump(user_id)
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+_profile_cache = _ProfileCache(_ProfileVersions(PROFILE_VERSION_FILE, PROFILE_VERSION_SLOTS), PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS)
+
+def _write_balance(user_id, profile, profile_stamp, new_balance):
+    """Set a user's current_points, keeping the profile cache honest; returns an error message or None.
+
+    Once the update is issued, any failure leaves its outcome unknown, so the cached row is
+    dropped rather than left at the old balance. A timed-out update may still commit on its
+    abandoned thread, so it is dropped again once that call's HTTP timeout has passed.
+    """
+    updated_at = datetime.now().isoformat()
+    try:
+        upd = _execute(supabase.table('user_profile').update({
+            'current_points': new_balance,
+            'updated_at': updated_at
+        }).eq('user_id', user_id))
+        err = _resp_error(upd)
+    except BaseException as e:
+        _profile_cache.invalidate(user_id)
+        if isinstance(e, UpstreamUnavailable):
+            late = threading.Timer(UPSTREAM_CALL_TIMEOUT_SECONDS, _profile_cache.invalidate, (user_id,))
+            late.daemon = True
+            late.start()
+        raise
+    if err:
+        _profile_cache.invalidate(user_id)
+        return err
+    _profile_cache.write_through(user_id, profile_stamp, dict(profile, current_points=new_balance, updated_at=updated_at))
+    return None
+
+def _get_profile(user_id):
+    """Read-through user_profile lookup; returns (row, stamp) where stamp feeds write_through."""
+    def fetch():
+        profile = _execute(supabase.table('user_profile').select('*').eq('user_id', user_id).single(), hedge=True)
+        err = _resp_error(profile)
+        if err:
+            raise _DatabaseError(err)
+        return profile.data
+    return _profile_cache.lookup(user_id, fetch)
+
+# Realtime push: balance changes go to the owning user, leaderboard top-N diffs to every subscriber
+STREAM_HEARTBEAT_SECONDS = float(os.getenv('STREAM_HEARTBEAT_SECONDS', '15'))
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '32'))
+# Production workers hold streams on an asyncio loop listening on STREAM_PORT (see _StreamServer);
+# the Flask /api/stream route, one thread per open stream, is only used by the development server
+STREAM_HOST = os.getenv('STREAM_HOST', '0.0.0.0')
+STREAM_PORT = int(os.getenv('STREAM_PORT', '5001'))
+STREAM_MAX_CONNECTIONS = int(os.getenv('STREAM_MAX_CONNECTIONS', '50000'))
+STREAM_HANDSHAKE_TIMEOUT_SECONDS = 10
+LEADERBOARD_STREAM_SIZE = int(os.getenv('LEADERBOARD_STREAM_SIZE', '10'))
+# EventSource cannot send headers, so browsers authenticate with ?token=<stream token> from
+# /api/stream/token: short-lived and refused by every other endpoint, as URLs end up in logs
+STREAM_TOKEN_TTL_SECONDS = int(os.getenv('STREAM_TOKEN_TTL_SECONDS', '60'))
+
+def _format_sse(event, payload):
+    """Encode one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+class _Subscription:
+    """One open stream: a small bounded mailbox and a wakeup flag, no thread of its own."""
+    __slots__ = ('user_id', 'frames', 'wakeup', 'notify')
+
+    def __init__(self, user_id=None, wakeup=None, notify=None):
+        self.user_id = user_id
+        # Slow readers drop their oldest frames instead of growing without bound
+        self.frames = deque(maxlen=STREAM_QUEUE_SIZE)
+        self.wakeup = wakeup or threading.Event()
+        # Subscribers on an event loop are woken through the loop instead of wakeup.set()
+        self.notify = notify
+
+    def push(self, frame):
+        self.frames.append(frame)
+        if self.notify:
+            self.notify(self)
+        else:
+            self.wakeup.set()
+
+    def drain(self, timeout):
+        """Wait up to timeout seconds for frames and return everything queued."""
+        if not self.frames:
+            self.wakeup.wait(timeout)
+        self.wakeup.clear()
+        out = []
+        while self.frames:
+            out.append(self.frames.popleft())
+        return out
+
+class _EventHub:
+    """In-process fan-out of pre-encoded SSE frames to user and broadcast subscribers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_user = {}
+        self._all = set()
+
+    def subscribe(self, user_id=None, **options):
+        sub = _Subscription(user_id, **options)
+        with self._lock:
+            self._all.add(sub)
+            if user_id:
+                self._by_user.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._all.discard(sub)
+            if sub.user_id:
+                subs = self._by_user.get(sub.user_id)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._by_user[sub.user_id]
+
+    def has_subscribers(self):
+        return bool(self._all)
+
+    def subscriber_count(self):
+        return len(self._all)
+
+    def publish_user(self, user_id, event, payload):
+        with self._lock:
+            subs = list(self._by_user.get(user_id, ()))
+        if not subs:
+            return
+        frame = _format_sse(event, payload)
+        for sub in subs:
+            sub.push(frame)
+
+    def broadcast(self, event, payload):
+        with self._lock:
+            subs = list(self._all)
+        if not subs:
+            return
+        # Encode once, share the same string across every mailbox
+        frame = _format_sse(event, payload)
+        for sub in subs:
+            sub.push(frame)
+
+class _LeaderboardTracker:
+    """Last published top-N, so a committed balance can be turned into a rank diff without re-querying."""
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = None  # user_id -> {"name", "points"}; None until seeded
+
+    def _ranking(self):
+        ordered = sorted(self._entries.items(), key=lambda kv: kv[1]['points'], reverse=True)
+        return [(uid, e['name'], e['points']) for uid, e in ordered[:self.size]]
+
+    def is_seeded(self):
+        return self._entries is not None
+
+    def reset(self):
+        """Forget the ranking; the next stream subscriber seeds it again."""
+        with self._lock:
+            self._entries = None
+
+    def seed(self, rows):
+        """Replace the tracked ranking with rows of (user_id, name, points), highest first."""
+        with self._lock:
+            self._entries = {uid: {'name': name, 'points': points} for uid, name, points in rows[:self.size]}
+
+    def snapshot(self):
+        with self._lock:
+            if self._entries is None:
+                return None
+            return [{'rank': i + 1, 'name': name, 'points': points}
+                    for i, (_, name, points) in enumerate(self._ranking())]
+
+    def apply(self, user_id, points, resolve_name, reload_rows):
+        """Record a committed balance and return the top-N diff, or None when nothing visible changed."""
+        with self._lock:
+            if self._entries is None:
+                return None
+            before = self._ranking()
+            tracked = user_id in self._entries
+            full = len(self._entries) >= self.size
+            floor = min((e['points'] for e in self._entries.values()), default=0)
+        if not tracked and full and points <= floor:
+            return None
+
+        if tracked and full and points < floor:
+            # The user fell out of the tracked window; whoever replaces them is unknown here
+            self.seed(reload_rows(self.size))
+        else:
+            name = None if tracked else resolve_name(user_id)
+            with self._lock:
+                if user_id in self._entries:
+                    self._entries[user_id]['points'] = points
+                else:
+                    self._entries[user_id] = {'name': name or 'User', 'points': points}
+                ordered = sorted(self._entries, key=lambda uid: self._entries[uid]['points'], reverse=True)
+                for uid in ordered[self.size:]:
+                    del self._entries[uid]
+
+        with self._lock:
+            after = self._ranking()
+        before_pos = {uid: (rank, pts) for rank, (uid, _, pts) in enumerate(before)}
+        after_ids = {uid for uid, _, _ in after}
+        changed = [{'rank': rank + 1, 'name': name, 'points': pts}
+                   for rank, (uid, name, pts) in enumerate(after)
+                   if before_pos.get(uid) != (rank, pts)]
+        removed = [name for uid, name, _ in before if uid not in after_ids]
+        if not changed and not removed:
+            return None
+        return {'changed': changed, 'removed': removed, 'size': self.size}
+
+_event_hub = _EventHub()
+_leaderboard = _LeaderboardTracker(LEADERBOARD_STREAM_SIZE)
+
+def _leaderboard_rows(limit):
+    """Fetch the current top-N as (user_id, username, points) straight from user_profile."""
+    result = _execute(supabase.table('user_profile').select(
+        'user_id, username, current_points'
+    ).eq('user_status', 'active').order('current_points', desc=True).limit(limit), hedge=True)
+    return [(r['user_id'], r.get('username') or 'User', r.get('current_points', 0)) for r in (result.data or [])]
+
+def _profile_username(user_id):
+    result = _execute(supabase.table('user_profile').select('username').eq('user_id', user_id), hedge=True)
+    return result.data[0].get('username') if result.data else None
+
+def _publish_balance_change(user_id, new_balance):
+    """Deliver a committed balance in this worker and, through _stream_bus, in every other one."""
+    _deliver_balance_change(user_id, new_balance)
+    if _stream_bus.running:
+        _stream_bus.publish(user_id, new_balance)
+
+def _deliver_balance_change(user_id, new_balance):
+    """Push a balance to the owner's streams here and a leaderboard diff to this worker's subscribers."""
+    try:
+        _event_hub.publish_user(user_id, 'balance', {
+            "points": new_balance,
+            "timestamp": datetime.now().isoformat()
+        })
+        # Leaderboard upkeep costs upstream reads, so only do it while someone is listening;
+        # a tracker that missed changes is dropped and seeded afresh by the next subscriber
+        if _event_hub.has_subscribers():
+            diff = _leaderboard.apply(user_id, new_balance, _profile_username, _leaderboard_rows)
+            if diff:
+                _event_hub.broadcast('leaderboard', diff)
+        else:
+            _leaderboard.reset()
+    except Exception as e:
+        print(f"Stream publish error: {e}")
+
+# Production workers each hold their own streams and leaderboard tracker, while a write lands on
+# whichever worker served it. Every worker binds a Unix datagram socket in SHARED_CACHE_DIR and
+# sends each committed balance to all the others, so every stream and tracker sees every write.
+STREAM_BUS_REFRESH_SECONDS = 1.0
+
+class _StreamBus:
+    """Balance changes between the workers on one host, as JSON datagrams over Unix sockets.
+
+    Peers are found by listing the socket directory, at most once per STREAM_BUS_REFRESH_SECONDS.
+    Sends never block: a peer whose receive buffer is full misses the message (counted as
+    stream.bus_dropped), and the socket of a worker that died is removed on the first refusal.
+    """
+
+    def __init__(self, directory, prefix):
+        self.directory = directory
+        self.prefix = prefix
+        self.path = None
+        self._sock = None
+        self._out = None
+        self._lock = threading.Lock()
+        self._peers = []
+        self._peers_at = 0.0
+
+    @property
+    def running(self):
+        return self._sock is not None
+
+    def start(self, deliver):
+        """Bind this process's socket and deliver(user_id, points) each message from a thread."""
+        if not hasattr(socket, 'AF_UNIX'):
+            return
+        self.path = os.path.join(self.directory, f'{self.prefix}{os.getpid()}.sock')
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.bind(self.path)
+        except OSError as e:
+            sock.close()
+            print(f"Stream bus unavailable, streams only see this worker's writes: {e}")
+            return
+        self._out = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._out.setblocking(False)
+        self._sock = sock
+        atexit.register(self._unlink, self.path)
+        threading.Thread(target=self._receive, args=(sock, deliver), name='stream-bus', daemon=True).start()
+
+    @staticmethod
+    def _receive(sock, deliver):
+        while True:
+            data = sock.recv(65536)
+            try:
+                message = json.loads(data)
+                deliver(message['user_id'], message['points'])
+            except Exception as e:
+                print(f"Stream bus error: {e}")
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _current_peers(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._peers_at >= STREAM_BUS_REFRESH_SECONDS:
+                pattern = os.path.join(self.directory, f'{self.prefix}*.sock')
+                self._peers = [path for path in glob.glob(pattern) if path != self.path]
+                self._peers_at = now
+            return self._peers
+
+    def publish(self, user_id, points):
+        data = json.dumps({'user_id': user_id, 'points': points}).encode()
+        for peer in self._current_peers():
+            try:
+                self._out.sendto(data, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that exited without cleaning up
+                self._unlink(peer)
+                with self._lock:
+                    self._peers_at = 0.0
+            except BlockingIOError:
+                _metrics.incr('stream.bus_dropped')
+            except OSError as e:
+                print(f"Stream bus send error: {e}")
+
+_stream_bus = _StreamBus(SHARED_CACHE_DIR, f'placebo-{APP_INSTANCE_ID}-bus-')
+
+# Ledger write-behind: point_transaction rows are journaled locally and bulk-flushed off the request path
+LEDGER_WRITE_BEHIND = os.getenv('LEDGER_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+LEDGER_JOURNAL_DIR = os.getenv('LEDGER_JOURNAL_DIR', 'ledger_journal')
+LEDGER_BATCH_SIZE = int(os.getenv('LEDGER_BATCH_SIZE', '500'))
+LEDGER_FLUSH_INTERVAL_SECONDS = float(os.getenv('LEDGER_FLUSH_INTERVAL_SECONDS', '1'))
+LEDGER_MAX_BACKOFF_SECONDS = 60
+# Rows the database rejects for good; the name stays outside the ledger-*.jsonl recovery glob
+LEDGER_DEAD_LETTER_FILE = 'dead-letter.jsonl'
+
+def _ledger_error_kind(e):
+    """How a failed point_transaction upsert should be handled: 'schema', 'row', or None to retry.
+
+    Postgres classes 42 (undefined column, missing ON CONFLICT constraint, permissions) and
+    PostgREST request errors fail every row alike; classes 22 and 23 (bad value, foreign key)
+    fail individual rows. Anything else, including timeouts and 5xx, is worth retrying.
+    """
+    if isinstance(e, UpstreamUnavailable):
+        return None
+    code = str(getattr(e, 'code', '') or '')
+    if code.startswith(('42', 'PGRST1', 'PGRST2')):
+        return 'schema'
+    if code.startswith(('22', '23')):
+        return 'row'
+    return None
+
+class _LedgerJournal:
+    """Append-only on-disk journal of point_transaction rows, drained to Supabase in bulk by a daemon thread.
+
+    Each process appends to its own segment and holds an exclusive flock on it, so a segment
+    whose lock can be taken belongs to a process that died; whichever process notices drains it.
+    Progress is checkpointed as a byte offset beside the segment. Rows carry a generated
+    transaction_id and are upserted with ignore_duplicates, so a crash between the bulk insert
+    and the checkpoint only causes a harmless replay (transaction_id needs the unique index from
+    migrations/0004_point_transaction_id.sql). Rows the database rejects permanently go to
+    dead-letter.jsonl instead of blocking the segment; move that file to ledger-replay.jsonl to
+    retry them once the cause is fixed.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.pid = os.getpid()
+        name = f'ledger-{self.pid}.jsonl' if fcntl else 'ledger.jsonl'
+        self.path = os.path.join(directory, name)
+        self._append_lock = threading.Lock()
+        self._file = open(self.path, 'ab')
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='ledger-flusher', daemon=True)
+        self._thread.start()
+
+    def append(self, row):
+        """Durably journal one row (fsync before returning) and return its transaction_id."""
+        row = dict(row, transaction_id=row.get('transaction_id') or str(uuid4()))
+        line = (json.dumps(row, default=str) + '\n').encode()
+        with self._append_lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        _metrics.incr('ledger.journaled')
+        return row['transaction_id']
+
+    def close(self):
+        """Stop the flusher and make a last attempt to drain this process's segment."""
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout=LEDGER_FLUSH_INTERVAL_SECONDS + 1)
+        try:
+            self._drain(self.path, compact=True)
+        except Exception as e:
+            print(f"Ledger flush on shutdown failed, rows stay journaled: {e}")
+
+    def _run(self):
+        delay = LEDGER_FLUSH_INTERVAL_SECONDS
+        while not self._stopped:
+            self._wakeup.wait(delay)
+            if self._stopped:
+                return
+            try:
+                self._drain(self.path, compact=True)
+                self._recover_orphans()
+                delay = LEDGER_FLUSH_INTERVAL_SECONDS
+            except Exception as e:
+                _metrics.incr('ledger.flush_errors')
+                print(f"Ledger flush error (retrying in {delay * 2:.0f}s): {e}")
+                delay = min(delay * 2, LEDGER_MAX_BACKOFF_SECONDS)
+
+    @staticmethod
+    def _read_offset(path):
+        try:
+            with open(path + '.offset') as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def _write_offset(path, offset):
+        tmp = path + '.offset.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path + '.offset')
+
+    def _drain(self, path, compact=False):
+        """Bulk-insert every complete journaled line past the checkpoint, one batch per round trip."""
+        offset = self._read_offset(path)
+        size = os.path.getsize(path)
+        if offset > size:
+            # Crashed between truncating and resetting the checkpoint; replays are idempotent
+            offset = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                batch = []
+                end = offset
+                while len(batch) < LEDGER_BATCH_SIZE:
+                    line = f.readline()
+                    if not line.endswith(b'\n'):
+                        break  # EOF, or a torn write that was never acknowledged
+                    batch.append(json.loads(line))
+                    end += len(line)
+                if not batch:
+                    break
+                self._insert(batch)
+                self._write_offset(path, end)
+                offset = end
+                _metrics.incr('ledger.flushed', len(batch))
+        if compact and offset > 0:
+            with self._append_lock:
+                if os.path.getsize(path) == offset:
+                    self._file.truncate(0)
+                    self._write_offset(path, 0)
+
+    def _insert(self, rows):
+        """Upsert rows; rows rejected permanently are dead-lettered, transient failures raise."""
+        try:
+            result = _execute(supabase.table('point_transaction').upsert(
+                rows, on_conflict='transaction_id', ignore_duplicates=True
+            ))
+        except Exception as e:
+            kind = _ledger_error_kind(e)
+            if kind is None:
+                raise
+            if kind == 'schema' or len(rows) == 1:
+                self._dead_letter(rows, e)
+                return
+            # Split until the offending rows are isolated; the rest still gets written
+            mid = len(rows) // 2
+            self._insert(rows[:mid])
+            self._insert(rows[mid:])
+            return
+        err = _resp_error(result)
+        if err:
+            raise _DatabaseError(err)
+
+    def _dead_letter(self, rows, error):
+        lines = b''.join((json.dumps(row, default=str) + '\n').encode() for row in rows)
+        fd = os.open(os.path.join(self.directory, LEDGER_DEAD_LETTER_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, lines)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        _metrics.incr('ledger.dead_lettered', len(rows))
+        print(f"Ledger: {len(rows)} point_transaction row(s) rejected by the database, moved to {LEDGER_DEAD_LETTER_FILE}: {error}")
+
+    def _recover_orphans(self):
+        if not fcntl:
+            return
+        for path in glob.glob(os.path.join(self.directory, 'ledger-*.jsonl')):
+            if path == self.path:
+                continue
+            with open(path, 'ab') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # owner is still alive
+                print(f"Recovering ledger journal {path}")
+                self._drain(path)
+                # Anything left is a torn final line that was never acknowledged
+                os.remove(path)
+                if os.path.exists(path + '.offset'):
+                    os.remove(path + '.offset')
+
+_ledger_lock = threading.Lock()
+_ledger = None
+
+def _ledger_journal():
+    """This process's journal, created on first use so forked workers never share one."""
+    global _ledger
+    if _ledger is None or _ledger.pid != os.getpid():
+        with _ledger_lock:
+            if _ledger is None or _ledger.pid != os.getpid():
+                _ledger = _LedgerJournal(LEDGER_JOURNAL_DIR)
+                atexit.register(_ledger.close)
+    return _ledger
+
+def _record_point_transaction(row):
+    """Write a point_transaction row, returning an error message or None.
+
+    With LEDGER_WRITE_BEHIND the row is journaled and acknowledged immediately; if the journal
+    itself cannot be written the row falls back to the synchronous insert.
+    """
+    if LEDGER_WRITE_BEHIND:
+        try:
+            _ledger_journal().append(row)
+            return None
+        except OSError as e:
+            print(f"Ledger journal unavailable, writing inline: {e}")
+    pt = _execute(supabase.table('point_transaction').insert(row))
+    return _resp_error(pt)
+
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
 def health():
     try:
         if supabase:
             # Test Supabase connection
-            result = supabase.table('user_profile').select("count", count='exact').limit(1).execute()
+            result = _execute(supabase.table('user_profile').select("count", count='exact').limit(1), hedge=True)
             db_status = "connected"
         else:
             db_status = "not configured"
@@ -169,6 +1703,23 @@ def health():
 
 
 
+def _registration_error(username, email, password):
+    """Validation message for sign-up fields, or None if they are acceptable."""
+    # Validate username
+    if not username or len(username) < 2:
+        return "Username must be at least 2 characters"
+    if len(username) > 20:
+        return "Username must be less than 20 characters"
+    
+    # Validate email
+    if not email or '@' not in email:
+        return "Valid email is required"
+    
+    # Validate password
+    if not password or len(password) < 6:
+        return "Password must be at least 6 characters"
+    return None
+
 # Login/Register endpoint
 @app.route('/api/auth/register', methods=['POST'])
 def register():
@@ -182,31 +1733,23 @@ def register():
         email = data.get('email', '').strip()
         password = data.get('password', '').strip()
         
-        # Validate username
-        if not username or len(username) < 2:
-            return create_error_response("Username must be at least 2 characters", 400)
-        if len(username) > 20:
-            return create_error_response("Username must be less than 20 characters", 400)
-        
-        # Validate email
-        if not email or '@' not in email:
-            return create_error_response("Valid email is required", 400)
-        
-        # Validate password
-        if not password or len(password) < 6:
-            return create_error_response("Password must be at least 6 characters", 400)
+        err = _registration_error(username, email, password)
+        if err:
+            return create_error_response(err, 400)
         
         # Check if username already exists
         try:
-            existing = supabase.table('user_profile').select('username').eq('username', username).execute()
+            existing = _execute(supabase.table('user_profile').select('username').eq('username', username), hedge=True)
             if existing.data:
                 return create_error_response("Username is already taken", 409)
+        except UpstreamUnavailable:
+            raise
         except Exception:
             pass
         
         # Create new user
         try:
-            auth_response = supabase.auth.sign_up({
+            auth_response = _call_upstream('auth', lambda: supabase.auth.sign_up({
                  "email": email,
                  "password": password,
                  "options": {
@@ -215,7 +1758,7 @@ def register():
                          "display_name": username
                      }
                  }
-             })
+             }))
             # normalize response (supports supabase-py dict/object shapes)
             user_id = _extract_user_id_from_auth_response(auth_response)
             if not user_id:
@@ -228,6 +1771,8 @@ def register():
                     return create_error_response("Password does not meet requirements", 400)
                 return create_error_response(str(err), 500)
              
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             error_msg = str(e).lower()
             if "email" in error_msg and "already" in error_msg:
@@ -240,25 +1785,30 @@ def register():
         
         # Get user profile (created by DB trigger)
         try:
-            profile = supabase.table('user_profile').select('*').eq('user_id', user_id).single().execute()
+            profile = _execute(supabase.table('user_profile').select('*').eq('user_id', user_id).single(), hedge=True)
             user_data = profile.data
             
             # Fix username if trigger saved it incorrectly (saves email before @ instead of actual username)
             if user_data.get('username') != username:
                 print(f"Fixing username in profile: {user_data.get('username')} -> {username}")
-                supabase.table('user_profile').update({'username': username}).eq('user_id', user_id).execute()
+                _execute(supabase.table('user_profile').update({'username': username}).eq('user_id', user_id))
+                _profile_cache.invalidate(user_id)
                 user_data['username'] = username
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             print(f"Profile fetch error: {e}")
             # Fallback: create profile if trigger didn't work
             try:
-                profile_insert = supabase.table('user_profile').insert({
+                profile_insert = _execute(supabase.table('user_profile').insert({
                     'user_id': user_id,
                     'username': username,
                     'current_points': 1000,
                     'user_status': 'active'
-                }).execute()
+                }))
                 user_data = profile_insert.data[0]
+            except UpstreamUnavailable:
+                raise
             except Exception as e2:
                 print(f"Profile creation error: {e2}")
                 return create_error_response("Registration completed but profile creation failed", 500)
@@ -282,6 +1832,8 @@ def register():
             "timestamp": datetime.now().isoformat()
         }), 201
         
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         print(f"Unexpected registration error: {e}")
         return create_error_response("Registration failed", 500)
@@ -289,6 +1841,7 @@ def register():
 
 # Login endpoint
 @app.route('/api/auth/login', methods=['POST'])
+@rate_limited('login', user_key=_login_user_key, failures_only=True)
 def login():
     """Login user with Supabase Auth"""
     try:
@@ -311,14 +1864,14 @@ def login():
             # Look up username in user_profile, fallback to display_name in auth
             try:
                 print(f"Looking up username: {identifier}")
-                profile = supabase.table('user_profile').select('user_id').eq('username', identifier).execute()
+                profile = _execute(supabase.table('user_profile').select('user_id').eq('username', identifier), hedge=True)
                 print(f"Profile lookup result: {profile.data}")
                 
                 if not profile.data or len(profile.data) == 0:
                     print("No profile data found for username, trying to find by display_name in auth")
                     # Fallback: user_profile might have wrong username, search by display_name in auth
                     try:
-                        users_response = supabase.auth.admin.list_users()
+                        users_response = _call_upstream('auth_admin', supabase.auth.admin.list_users, hedge=True)
                         users = users_response if isinstance(users_response, list) else getattr(users_response, 'users', [])
                         
                         for user in users:
@@ -330,13 +1883,16 @@ def login():
                                 
                                 # Update user_profile with correct username
                                 try:
-                                    supabase.table('user_profile').update({'username': identifier}).eq('user_id', user_id_from_auth).execute()
+                                    _execute(supabase.table('user_profile').update({'username': identifier}).eq('user_id', user_id_from_auth))
+                                    _profile_cache.invalidate(user_id_from_auth)
                                     print(f"Updated user_profile with correct username")
                                 except:
                                     pass
                                 break
                         else:
                             return create_error_response("Invalid credentials", 401)
+                    except UpstreamUnavailable:
+                        raise
                     except Exception as e2:
                         print(f"Display name lookup error: {e2}")
                         return create_error_response("Invalid credentials", 401)
@@ -348,7 +1904,7 @@ def login():
                     
                     # Get email from auth.users table using admin API
                     print(f"Looking up auth user for user_id: {user_id_from_profile}")
-                    auth_user = supabase.auth.admin.get_user_by_id(user_id_from_profile)
+                    auth_user = _call_upstream('auth_admin', lambda: supabase.auth.admin.get_user_by_id(user_id_from_profile), hedge=True)
                     email = auth_user.user.email
                     
                     if not email:
@@ -356,16 +1912,18 @@ def login():
                         return create_error_response("Invalid credentials", 401)
                         
                     print(f"Found email for username: {email}")
+            except UpstreamUnavailable:
+                raise
             except Exception as e:
                 print(f"Username lookup error: {e}")
                 return create_error_response("Invalid credentials", 401)
         
         # Sign in with Supabase Auth (checks auth.users table)
         try:
-            auth_response = supabase.auth.sign_in_with_password({
+            auth_response = _call_upstream('auth', lambda: supabase.auth.sign_in_with_password({
                 "email": email,
                 "password": password
-            })
+            }))
             # normalize response
             user_id = _extract_user_id_from_auth_response(auth_response)
             if not user_id:
@@ -381,6 +1939,8 @@ def login():
                     return create_error_response(str(err), 401)
                 return create_error_response("Invalid credentials", 401)
          
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             error_msg = str(e).lower()
             if "invalid" in error_msg or "credentials" in error_msg:
@@ -395,20 +1955,23 @@ def login():
         
         # Get user profile from user_profile table
         try:
-            profile = supabase.table('user_profile').select('*').eq('user_id', user_id).single().execute()
-            user_data = profile.data
+            user_data, profile_stamp = _get_profile(user_id)
             username = user_data.get('username', 'User')
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             print(f"Profile fetch error: {e}")
             return create_error_response("User profile not found", 404)
         
         # Update last login
         try:
-            supabase.table('user_profile').update({
-                'updated_at': datetime.now().isoformat()
-            }).eq('user_id', user_id).execute()
+            last_login = datetime.now().isoformat()
+            _execute(supabase.table('user_profile').update({
+                'updated_at': last_login
+            }).eq('user_id', user_id))
+            _profile_cache.write_through(user_id, profile_stamp, dict(user_data, updated_at=last_login))
         except Exception:
-            pass  # Non-critical
+            _profile_cache.invalidate(user_id)  # Non-critical, but the cached row may now be out of date
         
         # Create JWT token
         access_token = create_access_token(identity=user_id)
@@ -429,6 +1992,8 @@ def login():
             "timestamp": datetime.now().isoformat()
         })
         
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         print(f"Unexpected login error: {e}")
         return create_error_response("Login failed", 500)
@@ -441,7 +2006,7 @@ def logout():
     user_id = get_jwt_identity()
     
     try:
-        supabase.auth.sign_out()
+        _call_upstream('auth', supabase.auth.sign_out)
     except:
         pass  # Best effort sign out
     
@@ -458,12 +2023,10 @@ def get_user(user_id):
     
     try:
         # Get user profile
-        profile = supabase.table('user_profile').select('*').eq('user_id', user_id).single().execute()
-        user_data = profile.data
+        user_data, _ = _get_profile(user_id)
         
         # Get auth user for username
-        auth_user = supabase.auth.admin.get_user_by_id(user_id)
-        username = auth_user.user.user_metadata.get('username', 'User')
+        username = _auth_username(user_id)
         
         return jsonify({
             "id": user_id,
@@ -474,6 +2037,10 @@ def get_user(user_id):
             "lastLogin": user_data.get('updated_at')
         })
         
+    except UpstreamUnavailable:
+        raise
+    except _DatabaseError as e:
+        return create_error_response(f"Database error: {e}", 500)
     except Exception as e:
         print(f"Get user error: {e}")
         return create_error_response("User not found", 404)
@@ -481,6 +2048,8 @@ def get_user(user_id):
 # Update user points (after game)
 @app.route('/api/user/<user_id>/points', methods=['PUT'])
 @jwt_required()
+@rate_limited('points')
+@idempotent
 def update_points(user_id):
     """Update user points after game with transaction"""
     current_user = get_jwt_identity()
@@ -502,26 +2071,16 @@ def update_points(user_id):
         if not round_id:
             return create_error_response("round_id is required", 400)
         
-        profile = supabase.table('user_profile').select('current_points').eq('user_id', user_id).single().execute()
-        err = _resp_error(profile)
-        if err:
-            return create_error_response(f"Database error: {err}", 500)
-        current_points = profile.data['current_points']
+        profile, profile_stamp = _get_profile(user_id)
+        current_points = profile['current_points']
 
         new_balance = max(0, current_points + points_change)
         
-        upd = supabase.table('user_profile').update({
-            'current_points': new_balance,
-            'updated_at': datetime.now().isoformat()
-        }).eq('user_id', user_id).execute()
-        err = _resp_error(upd)
+        err = _write_balance(user_id, profile, profile_stamp, new_balance)
         if err:
             return create_error_response(f"Database error: {err}", 500)
         
-        updated_profile = supabase.table('user_profile').select('*').eq('user_id', user_id).single().execute()
-        err = _resp_error(updated_profile)
-        if err:
-            return create_error_response(f"Database error: {err}", 500)
+        _publish_balance_change(user_id, new_balance)
         
         return jsonify({
             "success": True,
@@ -529,6 +2088,10 @@ def update_points(user_id):
             "timestamp": datetime.now().isoformat()
         })
         
+    except UpstreamUnavailable:
+        raise
+    except _DatabaseError as e:
+        return create_error_response(f"Database error: {e}", 500)
     except Exception as e:
         print(f"Update points error: {e}")
         return create_error_response(f"Failed to update points: {str(e)}", 500)
@@ -547,14 +2110,14 @@ def get_history(user_id):
         offset = request.args.get('offset', 0, type=int)
         
         # Get rounds with game info
-        result = supabase.table('round').select(
+        result = _execute(supabase.table('round').select(
             'round_id, played_at, points_used, round_result, points_change, balance_after, round_data, game:game_id(game_name, game_type)'
-        ).eq('user_id', user_id).order('played_at', desc=True).range(offset, offset + limit - 1).execute()
+        ).eq('user_id', user_id).order('played_at', desc=True).range(offset, offset + limit - 1), hedge=True)
         
         rounds = result.data
         
         # Get total count
-        count_result = supabase.table('round').select('*', count='exact').eq('user_id', user_id).execute()
+        count_result = _execute(supabase.table('round').select('*', count='exact').eq('user_id', user_id), hedge=True)
         total = count_result.count
         
         # Format history
@@ -578,42 +2141,177 @@ def get_history(user_id):
             "timestamp": datetime.now().isoformat()
         })
         
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         print(f"Get history error: {e}")
         return create_error_response(f"Failed to retrieve game history: {str(e)}", 500)
 
+# Export full game history
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))
+EXPORT_CSV_COLUMNS = ['round_id', 'played_at', 'game_name', 'game_type', 'result', 'points_used', 'points_change', 'balance_after', 'round_data']
+
+def _iter_round_chunks(user_id, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield a user's rounds newest first, one keyset page per upstream call.
+
+    Pages continue from the last (played_at, round_id) seen instead of an offset, so every
+    page is an index range scan no matter how deep the export goes.
+    """
+    last = None
+    while True:
+        query = supabase.table('round').select(
+            'round_id, played_at, points_used, round_result, points_change, balance_after, round_data, game:game_id(game_name, game_type)'
+        ).eq('user_id', user_id)
+        if last:
+            played_at, round_id = last
+            query = query.or_(f'played_at.lt."{played_at}",and(played_at.eq."{played_at}",round_id.lt.{round_id})')
+        result = _execute(query.order('played_at', desc=True).order('round_id', desc=True).limit(chunk_size), hedge=True)
+        err = _resp_error(result)
+        if err:
+            raise _DatabaseError(err)
+        rows = result.data or []
+        # Stop on an empty page, not a short one: PostgREST may cap pages below chunk_size (db-max-rows)
+        if not rows:
+            return
+        yield rows
+        last = (rows[-1]['played_at'], rows[-1]['round_id'])
+
+def _export_record(row):
+    game = row.get('game') or {}
+    return {
+        "round_id": row.get('round_id'),
+        "played_at": row.get('played_at'),
+        "game_name": game.get('game_name', 'Unknown'),
+        "game_type": game.get('game_type', 'unknown'),
+        "result": row.get('round_result'),
+        "points_used": row.get('points_used'),
+        "points_change": row.get('points_change'),
+        "balance_after": row.get('balance_after'),
+        "round_data": row.get('round_data')
+    }
+
+@app.route('/api/user/<user_id>/history/export', methods=['GET'])
+@jwt_required()
+@rate_limited('export')
+def export_history(user_id):
+    """Stream a user's complete game history as NDJSON (default) or CSV"""
+    current_user = get_jwt_identity()
+    if current_user != user_id:
+        return create_error_response("Unauthorized", 401)
+    if not supabase:
+        return create_error_response("Database not configured", 503)
+    
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in ('ndjson', 'csv'):
+        return create_error_response("format must be ndjson or csv", 400)
+    
+    def generate():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if fmt == 'csv':
+            writer.writerow(EXPORT_CSV_COLUMNS)
+            yield buf.getvalue()
+        try:
+            # Each chunk is encoded and flushed as soon as it arrives; nothing accumulates
+            for rows in _iter_round_chunks(user_id):
+                buf.seek(0)
+                buf.truncate()
+                for row in rows:
+                    record = _export_record(row)
+                    if fmt == 'csv':
+                        record['round_data'] = json.dumps(record['round_data'], default=str)
+                        writer.writerow([record[c] for c in EXPORT_CSV_COLUMNS])
+                    else:
+                        buf.write(json.dumps(record, default=str))
+                        buf.write('\n')
+                yield buf.getvalue()
+        except Exception as e:
+            # Headers are already sent. Re-raising makes the server drop the connection without
+            # the terminating chunk, so clients see a failed download instead of a short file
+            print(f"Export history error for {user_id}: {e}")
+            raise
+    
+    return Response(generate(), mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson', headers={
+        'Content-Disposition': f'attachment; filename=history-{user_id}.{fmt}',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+
 # Get all users (for leaderboard)
+# A cold leaderboard may fall back to one count per user (see _games_played)
+LEADERBOARD_DEADLINE_SECONDS = float(os.getenv('LEADERBOARD_DEADLINE_SECONDS', '30'))
+_round_counts_rpc = True
+
+def _games_played(user_ids):
+    """Rounds per user, in one grouped query through the round_counts function (migrations/0003).
+
+    Databases without the function get one head-only count per user instead.
+    """
+    global _round_counts_rpc
+    if _round_counts_rpc and user_ids:
+        try:
+            result = _execute(supabase.rpc('round_counts', {'user_ids': user_ids}), hedge=True)
+            counts = {r['user_id']: r['games_played'] for r in (result.data or [])}
+            return {uid: counts.get(uid, 0) for uid in user_ids}
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            if getattr(e, 'code', None) == 'PGRST202':  # function not found
+                _round_counts_rpc = False
+            print(f"round_counts failed, counting per user: {e}")
+    counts = {}
+    for uid in user_ids:
+        rounds = _execute(supabase.table('round').select('round_id', count='exact', head=True).eq('user_id', uid), hedge=True)
+        counts[uid] = rounds.count or 0
+    return counts
+
+def _fetch_leaderboard(limit):
+    """Top users by points with usernames and games played; one upstream pass per (limit) flight."""
+    result = _execute(supabase.table('user_profile').select(
+        'user_id, username, current_points, created_at'
+    ).eq('user_status', 'active').order('current_points', desc=True).limit(limit), hedge=True)
+    err = _resp_error(result)
+    if err:
+        raise _DatabaseError(err)
+    
+    users = result.data
+    games_played = _games_played([user['user_id'] for user in users])
+    
+    user_list = []
+    ranked = []
+    for user in users:
+        try:
+            # Profiles store the username; auth metadata only backs up rows that lack one
+            username = user.get('username') or _auth_username(user['user_id'])
+            
+            user_list.append({
+                "name": username,
+                "points": user.get('current_points', 0),
+                "totalPoints": user.get('current_points', 0),
+                "gamesPlayed": games_played.get(user['user_id'], 0)
+            })
+            ranked.append((user['user_id'], username, user.get('current_points', 0)))
+        except UpstreamUnavailable:
+            raise
+        except:
+            continue
+    
+    # A full top-N read doubles as a fresh baseline for streamed leaderboard diffs
+    if limit >= LEADERBOARD_STREAM_SIZE and len(ranked) == len(users):
+        _leaderboard.seed(ranked)
+    
+    return user_list
+
 @app.route('/api/users', methods=['GET'])
 def get_users():
     """Get all users for leaderboard (public endpoint)"""
     try:
         limit = request.args.get('limit', 100, type=int)
+        limit = max(1, min(limit, MAX_LEADERBOARD_LIMIT))
         
-        # Get top users by points
-        result = supabase.table('user_profile').select(
-            'user_id, current_points, created_at'
-        ).eq('user_status', 'active').order('current_points', desc=True).limit(limit).execute()
-        
-        users = result.data
-        
-        # Get usernames from auth
-        user_list = []
-        for user in users:
-            try:
-                auth_user = supabase.auth.admin.get_user_by_id(user['user_id'])
-                username = auth_user.user.user_metadata.get('username', 'User')
-                
-                # Get games played count
-                rounds = supabase.table('round').select('*', count='exact').eq('user_id', user['user_id']).execute()
-                
-                user_list.append({
-                    "name": username,
-                    "points": user.get('current_points', 0),
-                    "totalPoints": user.get('current_points', 0),
-                    "gamesPlayed": rounds.count
-                })
-            except:
-                continue
+        # Callers waiting on a cold fill share its budget rather than timing out first
+        g.deadline = time.monotonic() + LEADERBOARD_DEADLINE_SECONDS
+        user_list = _shared_read(('users', limit), lambda: _fetch_leaderboard(limit))
         
         return jsonify({
             "success": True,
@@ -623,6 +2321,10 @@ def get_users():
             "timestamp": datetime.now().isoformat()
         })
         
+    except UpstreamUnavailable:
+        raise
+    except _DatabaseError as e:
+        return create_error_response(f"Database error: {e}", 500)
     except Exception as e:
         print(f"Get users error: {e}")
         return create_error_response(f"Failed to retrieve users: {str(e)}", 500)
@@ -633,17 +2335,15 @@ def get_stats(user_id):
     """Get user statistics (public endpoint)"""
     try:
         # Get user profile
-        profile = supabase.table('user_profile').select('*').eq('user_id', user_id).single().execute()
-        user_data = profile.data
+        user_data, _ = _get_profile(user_id)
         
         # Get rounds
-        rounds = supabase.table('round').select('round_result, points_change').eq('user_id', user_id).execute()
+        rounds = _execute(supabase.table('round').select('round_result, points_change').eq('user_id', user_id), hedge=True)
         history = rounds.data
         
         # Get username
         try:
-            auth_user = supabase.auth.admin.get_user_by_id(user_id)
-            username = auth_user.user.user_metadata.get('username', 'User')
+            username = _auth_username(user_id)
         except:
             username = 'User'
         
@@ -673,6 +2373,10 @@ def get_stats(user_id):
             "timestamp": datetime.now().isoformat()
         })
         
+    except UpstreamUnavailable:
+        raise
+    except _DatabaseError as e:
+        return create_error_response(f"Database error: {e}", 500)
     except Exception as e:
         print(f"Get stats error: {e}")
         return create_error_response(f"Failed to retrieve stats: {str(e)}", 500)
@@ -680,6 +2384,7 @@ def get_stats(user_id):
 # Reward codes - Generate
 @app.route('/api/rewards/generate', methods=['POST'])
 @jwt_required()
+@idempotent
 def generate_reward():
     """Generate reward code (admin endpoint)"""
     # Require service role key for writes
@@ -699,7 +2404,7 @@ def generate_reward():
         # Create reward in database
         code = generate_reward_code()
         
-        result = supabase.table('reward').insert({
+        result = _execute(supabase.table('reward').insert({
             'reward_name': f'Bonus Code {code}',
             'reward_description': f'{points} bonus points',
             'reward_type': 'gift_card',
@@ -707,7 +2412,7 @@ def generate_reward():
             'point_amount': points,
             'is_active': True,
             'quantity_in_stock': 1
-        }).execute()
+        }))
         err = _resp_error(result)
         if err:
             return create_error_response(f"Database error: {err}", 500)
@@ -722,6 +2427,8 @@ def generate_reward():
             "timestamp": datetime.now().isoformat()
         })
         
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         print(f"Generate reward error: {e}")
         return create_error_response(f"Failed to generate reward code: {str(e)}", 500)
@@ -729,6 +2436,7 @@ def generate_reward():
 # Reward codes - Redeem
 @app.route('/api/rewards/redeem', methods=['POST'])
 @jwt_required()
+@idempotent
 def redeem_reward():
     """Redeem reward code"""
     current_user = get_jwt_identity()
@@ -752,7 +2460,7 @@ def redeem_reward():
             return create_error_response("user_id and code required", 400)
         
         # Find reward by code (in reward_name or description)
-        rewards = supabase.table('reward').select('*').ilike('reward_name', f'%{code}%').eq('is_active', True).execute()
+        rewards = _execute(supabase.table('reward').select('*').ilike('reward_name', f'%{code}%').eq('is_active', True), hedge=True)
         err = _resp_error(rewards)
         if err:
             return create_error_response(f"Database error: {err}", 500)
@@ -763,7 +2471,7 @@ def redeem_reward():
         reward = rewards.data[0]
         
         # Check if already redeemed
-        existing = supabase.table('reward_redemption').select('*').eq('user_id', user_id).eq('reward_id', reward['reward_id']).execute()
+        existing = _execute(supabase.table('reward_redemption').select('*').eq('user_id', user_id).eq('reward_id', reward['reward_id']), hedge=True)
         err = _resp_error(existing)
         if err:
             return create_error_response(f"Database error: {err}", 500)
@@ -776,24 +2484,21 @@ def redeem_reward():
             return create_error_response("Reward code has no uses left", 400)
         
         # Get current points
-        profile = supabase.table('user_profile').select('current_points').eq('user_id', user_id).single().execute()
-        err = _resp_error(profile)
-        if err:
-            return create_error_response(f"Database error: {err}", 500)
-        current_points = profile.data['current_points']
+        profile, profile_stamp = _get_profile(user_id)
+        current_points = profile['current_points']
         
         # Add points
         points_to_add = reward.get('point_amount', 0)
         new_balance = current_points + points_to_add
         
         # Create redemption
-        redemption = supabase.table('reward_redemption').insert({
+        redemption = _execute(supabase.table('reward_redemption').insert({
             'user_id': user_id,
             'reward_id': reward['reward_id'],
             'points_spent': 0,
             'redemption_code': code,
             'redemption_status': 'issued'
-        }).execute()
+        }))
         err = _resp_error(redemption)
         if err:
             return create_error_response(f"Database error: {err}", 500)
@@ -801,35 +2506,32 @@ def redeem_reward():
         redemption_id = redemption.data[0]['redemption_id']
         
         # Create point transaction
-        pt = supabase.table('point_transaction').insert({
+        err = _record_point_transaction({
             'user_id': user_id,
             'transaction_type': 'REDEEM_REWARD',
             'transaction_change': points_to_add,
             'balance_after': new_balance,
             'redemption_id': redemption_id,
             'description': f'Redeemed code {code}'
-        }).execute()
-        err = _resp_error(pt)
+        })
         if err:
             return create_error_response(f"Database error: {err}", 500)
         
         # Update user points
-        upd = supabase.table('user_profile').update({
-            'current_points': new_balance,
-            'updated_at': datetime.now().isoformat()
-        }).eq('user_id', user_id).execute()
-        err = _resp_error(upd)
+        err = _write_balance(user_id, profile, profile_stamp, new_balance)
         if err:
             return create_error_response(f"Database error: {err}", 500)
         
         # Decrement stock
-        dec = supabase.table('reward').update({
+        dec = _execute(supabase.table('reward').update({
             'quantity_in_stock': reward['quantity_in_stock'] - 1
-        }).eq('reward_id', reward['reward_id']).execute()
+        }).eq('reward_id', reward['reward_id']))
         err = _resp_error(dec)
         if err:
             return create_error_response(f"Database error: {err}", 500)
         
+        _publish_balance_change(user_id, new_balance)
+        
         return jsonify({
             "success": True,
             "pointsAdded": points_to_add,
@@ -838,13 +2540,123 @@ def redeem_reward():
             "timestamp": datetime.now().isoformat()
         })
         
+    except UpstreamUnavailable:
+        raise
+    except _DatabaseError as e:
+        return create_error_response(f"Database error: {e}", 500)
     except Exception as e:
         print(f"Redeem reward error: {e}")
         return create_error_response(f"Failed to redeem reward code: {str(e)}", 500)
 
+# Round outcome verification
+# Submitted outcomes are checked against the game's payout rules before anything is written.
+# Verifiers return a rejection reason, or None when the round is consistent.
+BLACKJACK_PAYOUT = 1.5  # natural pays 3:2
+# Largest net win per point staked for game types without a dedicated verifier
+ROUND_MAX_WIN_MULTIPLIER = float(os.getenv('ROUND_MAX_WIN_MULTIPLIER', str(BLACKJACK_PAYOUT)))
+ROUND_RESULTS = ('win', 'loss', 'push', 'blackjack')
+_CARD_VALUES = {'A': 11, 'J': 10, 'Q': 10, 'K': 10, **{str(n): n for n in range(2, 11)}}
+
+def _verify_round_bounds(points_used, round_result, points_change, max_win_multiplier):
+    if round_result == 'loss':
+        if not -points_used <= points_change < 0:
+            return f"a loss must cost between 1 and {points_used} points"
+    elif round_result == 'push':
+        if points_change != 0:
+            return "a push must not change the balance"
+    elif not 0 < points_change <= int(points_used * max_win_multiplier):
+        return f"a {round_result} must pay between 1 and {int(points_used * max_win_multiplier)} points"
+    return None
+
+def _hand_value(cards):
+    """Blackjack value of card strings like '10♠', counting aces as 1 where needed; None if malformed."""
+    total = aces = 0
+    for card in cards:
+        value = _CARD_VALUES.get(card[:-1]) if isinstance(card, str) else None
+        if value is None:
+            return None
+        total += value
+        aces += value == 11
+    while total > 21 and aces:
+        total -= 10
+        aces -= 1
+    return total
+
+def _verify_blackjack(points_used, round_result, points_change, round_data):
+    # No doubling, splitting or surrender: a loss costs the whole bet, a win pays even money
+    # or 3:2 on a natural (the client reports naturals as either 'win' or 'blackjack')
+    if round_result == 'loss' and points_change != -points_used:
+        return "a blackjack loss must cost the full bet"
+    if round_result in ('win', 'blackjack') and points_change not in (points_used, int(points_used * BLACKJACK_PAYOUT)):
+        return "a blackjack win must pay 1:1 or 3:2"
+    if round_result == 'blackjack' and points_change != int(points_used * BLACKJACK_PAYOUT):
+        return "a natural blackjack must pay 3:2"
+
+    if 'bet' in round_data and round_data['bet'] != points_used:
+        return "round_data.bet does not match points_used"
+    # The dealer hand is not checked: the client records it before the dealer draws
+    player_hand = round_data.get('playerHand')
+    if player_hand:
+        if not isinstance(player_hand, list):
+            return "round_data.playerHand must be a list of cards"
+        value = _hand_value(player_hand)
+        if value is None:
+            return "round_data.playerHand contains an invalid card"
+        if 'playerValue' in round_data and round_data['playerValue'] != value:
+            return "round_data.playerValue does not match playerHand"
+        if value > 21 and round_result != 'loss':
+            return "a busted hand must lose"
+        natural_payout = int(points_used * BLACKJACK_PAYOUT)
+        if points_change == natural_payout != points_used and not (len(player_hand) == 2 and value == 21):
+            return "only a two-card 21 pays 3:2"
+    return None
+
+_ROUND_VERIFIERS = {
+    'blackjack': (BLACKJACK_PAYOUT, _verify_blackjack),
+}
+
+def _verify_round(game_type, points_used, round_result, points_change, round_data):
+    """Reason the submitted outcome is impossible for game_type, or None if it checks out."""
+    if round_result not in ROUND_RESULTS:
+        return f"result must be one of {', '.join(ROUND_RESULTS)}"
+    if round_data is not None and not isinstance(round_data, dict):
+        return "round_data must be an object"
+    max_win_multiplier, verifier = _ROUND_VERIFIERS.get(game_type, (ROUND_MAX_WIN_MULTIPLIER, None))
+    reason = _verify_round_bounds(points_used, round_result, points_change, max_win_multiplier)
+    if reason is None and verifier:
+        reason = verifier(points_used, round_result, points_change, round_data or {})
+    return reason
+
+def _fetch_game_catalog():
+    result = _execute(supabase.table('game').select('*'), hedge=True)
+    err = _resp_error(result)
+    if err:
+        raise _DatabaseError(err)
+    return result.data
+
+def _is_uuid(value):
+    try:
+        UUID(str(value))
+        return True
+    except Exception:
+        return False
+
+def _resolve_game(game_id):
+    """Game row for a UUID, or for a game name / game_type as sent by older clients; None if unknown."""
+    games = _shared_read(('games', 'all'), _fetch_game_catalog)
+    # Non-UUIDs match on exact name first, then fall back to game_type
+    fields = ('game_id',) if _is_uuid(game_id) else ('game_name', 'game_type')
+    for field in fields:
+        for game in games:
+            if game.get(field) == game_id:
+                return game
+    return None
+
 # Create game round
 @app.route('/api/game/round', methods=['POST'])
 @jwt_required()
+@rate_limited('round')
+@idempotent
 def create_round():
     """Create a new game round"""
     current_user = get_jwt_identity()
@@ -869,38 +2681,21 @@ def create_round():
             return create_error_response("Unauthorized", 401)
         
         # Get current points
-        profile = supabase.table('user_profile').select('current_points').eq('user_id', user_id).single().execute()
-        err = _resp_error(profile)
-        if err:
-            return create_error_response(f"Database error: {err}", 500)
-        current_points = profile.data['current_points']
+        profile, profile_stamp = _get_profile(user_id)
+        current_points = profile['current_points']
 
         # Resolve game_id: if client sent a non-UUID (e.g. 'blackjack' or game name), look up the game row
         resolved_game_id = game_id
         min_bet_points = None
+        game_type = None
         if game_id:
-            try:
-                UUID(str(game_id))
-            except Exception:
-                try:
-                    # Try to find game by exact name first
-                    game_row = supabase.table('game').select('*').eq('game_name', game_id).execute()
-                    err = _resp_error(game_row)
-                    if err:
-                        return create_error_response(f"Database error: {err}", 500)
-                    if not game_row.data:
-                        # Fallback to searching by game_type
-                        game_row = supabase.table('game').select('*').eq('game_type', game_id).execute()
-                        err = _resp_error(game_row)
-                        if err:
-                            return create_error_response(f"Database error: {err}", 500)
-                    if not game_row.data:
-                        return create_error_response("Invalid game_id", 400)
-                    resolved_game_id = game_row.data[0]['game_id']
-                    min_bet_points = game_row.data[0].get('min_bet_points', None)
-                except Exception as e:
-                    print(f"Game lookup error: {e}")
-                    return create_error_response("Invalid game_id", 400)
+            game = _resolve_game(game_id)
+            if game:
+                resolved_game_id = game['game_id']
+                min_bet_points = game.get('min_bet_points', None)
+                game_type = game.get('game_type')
+            elif not _is_uuid(game_id):
+                return create_error_response("Invalid game_id", 400)
 
         # Ensure points_used meets game minimums and DB constraints
         try:
@@ -914,11 +2709,26 @@ def create_round():
         if points_used <= 0:
             return create_error_response("points_used must be a positive integer", 400)
 
+        # The stake bounds every payout check below, so it must be one the player could place
+        if min_bet_points and points_used < int(min_bet_points):
+            return create_error_response(f"points_used is below this game's minimum bet of {int(min_bet_points)}", 400)
+        if points_used > current_points:
+            return create_error_response(f"points_used exceeds the current balance of {current_points}", 400)
+
+        if isinstance(points_change, bool) or not isinstance(points_change, int):
+            return create_error_response("points_change must be an integer", 400)
+
+        reason = _verify_round(game_type, points_used, round_result, points_change, round_data)
+        if reason:
+            _metrics.incr('rounds.rejected')
+            print(f"Rejected round from {user_id} ({game_type or game_id}): {reason}")
+            return create_error_response(f"Invalid round outcome: {reason}", 400)
+
         # Calculate new balance
         new_balance = max(0, current_points + points_change)
 
         # Create round
-        round_insert = supabase.table('round').insert({
+        round_insert = _execute(supabase.table('round').insert({
             'user_id': user_id,
             'game_id': resolved_game_id,
             'points_used': points_used,
@@ -926,7 +2736,7 @@ def create_round():
             'points_change': points_change,
             'balance_after': new_balance,
             'round_data': round_data
-        }).execute()
+        }))
         err = _resp_error(round_insert)
         if err:
             return create_error_response(f"Database error: {err}", 500)
@@ -941,27 +2751,24 @@ def create_round():
             'blackjack': 'BLACKJACK'
         }.get(round_result, 'GAME_LOSS')
         
-        pt = supabase.table('point_transaction').insert({
+        err = _record_point_transaction({
             'user_id': user_id,
             'transaction_type': transaction_type,
             'transaction_change': points_change,
             'balance_after': new_balance,
             'round_id': round_id,
             'description': f'{round_result.capitalize()} - {points_used} points bet'
-        }).execute()
-        err = _resp_error(pt)
+        })
         if err:
             return create_error_response(f"Database error: {err}", 500)
         
         # Update user points
-        upd = supabase.table('user_profile').update({
-            'current_points': new_balance,
-            'updated_at': datetime.now().isoformat()
-        }).eq('user_id', user_id).execute()
-        err = _resp_error(upd)
+        err = _write_balance(user_id, profile, profile_stamp, new_balance)
         if err:
             return create_error_response(f"Database error: {err}", 500)
         
+        _publish_balance_change(user_id, new_balance)
+        
         return jsonify({
             "success": True,
             "round_id": round_id,
@@ -969,11 +2776,22 @@ def create_round():
             "timestamp": datetime.now().isoformat()
         })
         
+    except UpstreamUnavailable:
+        raise
+    except _DatabaseError as e:
+        return create_error_response(f"Database error: {e}", 500)
     except Exception as e:
         print(f"Create round error: {e}")
         return create_error_response(f"Failed to create round: {str(e)}", 500)
 
 # Get available games
+def _fetch_games(status):
+    result = _execute(supabase.table('game').select('*').eq('game_status', status), hedge=True)
+    err = _resp_error(result)
+    if err:
+        raise _DatabaseError(err)
+    return result.data
+
 @app.route('/api/games', methods=['GET'])
 def get_games():
     """Get available games"""
@@ -981,11 +2799,7 @@ def get_games():
         if not supabase:
             return create_error_response("Database not configured", 503)
 
-        result = supabase.table('game').select('*').eq('game_status', 'waiting').execute()
-        err = _resp_error(result)
-        if err:
-            return create_error_response(f"Database error: {err}", 500)
-        games = result.data
+        games = _shared_read(('games', 'waiting'), lambda: _fetch_games('waiting'))
         
         return jsonify({
             "success": True,
@@ -993,11 +2807,631 @@ def get_games():
             "timestamp": datetime.now().isoformat()
         })
         
+    except UpstreamUnavailable:
+        raise
+    except _DatabaseError as e:
+        return create_error_response(f"Database error: {e}", 500)
     except Exception as e:
         print(f"Get games error: {e}")
         return create_error_response(f"Failed to retrieve games: {str(e)}", 500)
 
+# Realtime stream
+@app.route('/api/stream/token', methods=['POST'])
+@jwt_required()
+def create_stream_token():
+    """Short-lived token for opening /api/stream?token=<token>; fetch a new one before each (re)connect"""
+    token = create_access_token(
+        identity=get_jwt_identity(),
+        expires_delta=timedelta(seconds=STREAM_TOKEN_TTL_SECONDS),
+        additional_claims={'scope': 'stream'}
+    )
+    return jsonify({
+        "success": True,
+        "token": token,
+        "expiresIn": STREAM_TOKEN_TTL_SECONDS,
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route('/api/stream', methods=['GET'])
+def stream():
+    """Server-Sent Events stream of leaderboard diffs, plus balance changes when authenticated.
+
+    Authenticate with an Authorization header or, from EventSource, ?token=<stream token>.
+    """
+    if _stream_server.running:
+        # Each open stream would pin one of the worker's request threads
+        return create_error_response(f"Streams are served on port {STREAM_PORT}", 404)
+    
+    try:
+        user_id = _stream_identity(request.query_string.decode('latin-1'), request.headers.get('Authorization'))
+    except Exception as e:
+        return create_error_response(f"Invalid token: {e}", 401)
+    _seed_stream_leaderboard()
+    sub = _event_hub.subscribe(user_id)
+    snapshot = _leaderboard.snapshot()
+    
+    def generate():
+        try:
+            yield _stream_preamble(snapshot)
+            while True:
+                frames = sub.drain(STREAM_HEARTBEAT_SECONDS)
+                # Comment frames keep proxies from closing idle connections
+                yield ''.join(frames) if frames else ": keepalive\n\n"
+        finally:
+            _event_hub.unsubscribe(sub)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def _seed_stream_leaderboard():
+    if supabase and not _leaderboard.is_seeded():
+        try:
+            _leaderboard.seed(_leaderboard_rows(LEADERBOARD_STREAM_SIZE))
+        except Exception as e:
+            print(f"Leaderboard seed error: {e}")
+
+def _stream_identity(query, authorization):
+    """User id a stream connection authenticates as, None when anonymous; raises on a bad token.
+
+    A header may carry a regular access token; the query string only a stream token.
+    """
+    with app.app_context():
+        if authorization and authorization.lower().startswith('bearer '):
+            return decode_token(authorization[7:].strip())['sub']
+        token = parse_qs(query).get('token', [None])[0]
+        if not token:
+            return None
+        claims = decode_token(token)
+        if claims.get('scope') != 'stream':
+            raise ValueError("query-string tokens must come from /api/stream/token")
+        return claims['sub']
+
+def _stream_preamble(snapshot):
+    preamble = "retry: 5000\n\n"
+    if snapshot is not None:
+        preamble += _format_sse('leaderboard', {"top": snapshot, "size": LEADERBOARD_STREAM_SIZE})
+    return preamble
+
+class _StreamServer:
+    """Serves /api/stream from one asyncio loop thread per worker, off the request thread pool.
+
+    An open stream costs a socket, a coroutine and its mailbox rather than a thread, so one process
+    holds tens of thousands. Publishers on request threads wake the loop at most once per batch of
+    pushes, however many subscribers a broadcast reaches.
+    """
+
+    def __init__(self, host, port, max_connections):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.loop = None
+        self.connections = 0
+        self._ready = []
+        self._ready_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.loop is not None
+
+    def start(self):
+        started = threading.Event()
+        errors = []
+        threading.Thread(target=self._run, args=(started, errors), name='stream-server', daemon=True).start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+    def _run(self, started, errors):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            # Every worker binds the same port; the kernel spreads connections across them
+            reuse = {'reuse_port': True} if hasattr(socket, 'SO_REUSEPORT') else {}
+            loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port, backlog=1024, **reuse))
+        except Exception as e:
+            errors.append(e)
+            started.set()
+            return
+        self.loop = loop
+        started.set()
+        loop.run_forever()
+
+    def notify(self, sub):
+        """Wake sub's coroutine from a publisher thread."""
+        with self._ready_lock:
+            self._ready.append(sub)
+            if len(self._ready) > 1:
+                return  # a wakeup is already scheduled and will take this one too
+        self.loop.call_soon_threadsafe(self._wake_ready)
+
+    def _wake_ready(self):
+        with self._ready_lock:
+            ready, self._ready = self._ready, []
+        for sub in ready:
+            sub.wakeup.set()
+
+    @staticmethod
+    def _respond(writer, status, body=b'', headers=()):
+        head = [f"HTTP/1.1 {status}", "Access-Control-Allow-Origin: *", "Connection: close", *headers]
+        if body:
+            head += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), STREAM_HANDSHAKE_TIMEOUT_SECONDS)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                return
+            lines = head.decode('latin-1').split('\r\n')
+            method, target = (lines[0].split(' ') + ['', ''])[:2]
+            headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(':') for line in lines[1:] if line)}
+            path, _, query = target.partition('?')
+            if method == 'OPTIONS':
+                self._respond(writer, "204 No Content", headers=[
+                    "Access-Control-Allow-Methods: GET", "Access-Control-Allow-Headers: Authorization"])
+            elif path != '/api/stream':
+                self._respond(writer, "404 Not Found", json.dumps({"success": False, "error": "Not found"}).encode())
+            elif method != 'GET':
+                self._respond(writer, "405 Method Not Allowed", json.dumps({"success": False, "error": "Method not allowed"}).encode())
+            elif self.connections >= self.max_connections:
+                _metrics.incr('stream.rejected')
+                self._respond(writer, "503 Service Unavailable", json.dumps({"success": False, "error": "Too many open streams"}).encode(),
+                              headers=["Retry-After: 5"])
+            else:
+                await self._stream(reader, writer, query, headers)
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            print(f"Stream server error: {e}")
+        finally:
+            writer.close()
+
+    async def _stream(self, reader, writer, query, headers):
+        try:
+            user_id = _stream_identity(query, headers.get('authorization'))
+        except Exception as e:
+            self._respond(writer, "401 Unauthorized", json.dumps({"success": False, "error": f"Invalid token: {e}"}).encode())
+            return
+        if supabase and not _leaderboard.is_seeded():
+            await asyncio.get_running_loop().run_in_executor(None, _seed_stream_leaderboard)
+        self.connections += 1
+        sub = _event_hub.subscribe(user_id, wakeup=asyncio.Event(), notify=self.notify)
+        try:
+            self._respond(writer, "200 OK", headers=[
+                "Content-Type: text/event-stream", "Cache-Control: no-cache", "X-Accel-Buffering: no"])
+            writer.write(_stream_preamble(_leaderboard.snapshot()).encode())
+            await writer.drain()
+            while True:
+                if not sub.frames:
+                    try:
+                        await asyncio.wait_for(sub.wakeup.wait(), STREAM_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                sub.wakeup.clear()
+                frames = []
+                while sub.frames:
+                    frames.append(sub.frames.popleft())
+                # Comment frames keep proxies from closing idle connections
+                writer.write((''.join(frames) if frames else ": keepalive\n\n").encode())
+                await writer.drain()
+        finally:
+            _event_hub.unsubscribe(sub)
+            self.connections -= 1
+
+_stream_server = _StreamServer(STREAM_HOST, STREAM_PORT, STREAM_MAX_CONNECTIONS)
+
+# Admin bulk provisioning: register() makes several sequential calls per user; this creates
+# auth users in parallel and writes all their profiles in bulk upserts
+BULK_PROVISION_MAX_USERS = int(os.getenv('BULK_PROVISION_MAX_USERS', '1000'))
+BULK_PROVISION_CONCURRENCY = int(os.getenv('BULK_PROVISION_CONCURRENCY', '8'))
+BULK_PROVISION_DEADLINE_SECONDS = float(os.getenv('BULK_PROVISION_DEADLINE_SECONDS', '300'))
+BULK_CHUNK_SIZE = 200
+
+def _create_auth_user(spec):
+    """Create one confirmed auth user; returns (user_id, error)."""
+    try:
+        auth_response = _call_upstream('auth_admin', lambda: supabase.auth.admin.create_user({
+            "email": spec['email'],
+            "password": spec['password'],
+            "email_confirm": True,
+            "user_metadata": {
+                "username": spec['username'],
+                "display_name": spec['username']
+            }
+        }))
+    except Exception as e:
+        return None, str(e)
+    user_id = _extract_user_id_from_auth_response(auth_response)
+    if not user_id:
+        return None, str(_extract_error_from_auth_response(auth_response) or "User creation failed")
+    return user_id, None
+
+@app.route('/api/admin/users/bulk', methods=['POST'])
+@jwt_required()
+@admin_required
+def bulk_provision_users():
+    """Create many users in one call (admin endpoint)
+
+    Body: {"users": [{"username", "email", "password", "points"?}, ...]}. Users that fail
+    validation or creation are listed under "failed"; the rest are created.
+    """
+    if not supabase or not IS_SERVICE_ROLE:
+        return create_error_response("Server misconfiguration: SUPABASE_SERVICE_ROLE_KEY missing or DB not configured", 503)
+    
+    try:
+        data = request.get_json()
+        specs = data.get('users') if isinstance(data, dict) else None
+        if not isinstance(specs, list) or not specs:
+            return create_error_response("users must be a non-empty list", 400)
+        if len(specs) > BULK_PROVISION_MAX_USERS:
+            return create_error_response(f"At most {BULK_PROVISION_MAX_USERS} users per request", 400)
+        g.deadline = time.monotonic() + BULK_PROVISION_DEADLINE_SECONDS
+        
+        failed = []
+        valid = []
+        seen = set()
+        for spec in specs:
+            spec = spec if isinstance(spec, dict) else {}
+            username = str(spec.get('username', '')).strip()
+            email = str(spec.get('email', '')).strip()
+            password = str(spec.get('password', '')).strip()
+            points = spec.get('points', 1000)
+            err = _registration_error(username, email, password)
+            if not err and (isinstance(points, bool) or not isinstance(points, int) or points < 0):
+                err = "points must be a non-negative integer"
+            if not err and username in seen:
+                err = "Duplicate username in request"
+            if err:
+                failed.append({"username": username, "email": email, "error": err})
+                continue
+            seen.add(username)
+            valid.append({"username": username, "email": email, "password": password, "points": points})
+        
+        # One lookup per chunk of names instead of one per user
+        taken = set()
+        names = [spec['username'] for spec in valid]
+        for start in range(0, len(names), BULK_CHUNK_SIZE):
+            existing = _execute(supabase.table('user_profile').select('username').in_('username', names[start:start + BULK_CHUNK_SIZE]), hedge=True)
+            err = _resp_error(existing)
+            if err:
+                return create_error_response(f"Database error: {err}", 500)
+            taken.update(row['username'] for row in existing.data or [])
+        for spec in [spec for spec in valid if spec['username'] in taken]:
+            failed.append({"username": spec['username'], "email": spec['email'], "error": "Username is already taken"})
+        valid = [spec for spec in valid if spec['username'] not in taken]
+        
+        with ThreadPoolExecutor(max_workers=max(1, BULK_PROVISION_CONCURRENCY)) as pool:
+            results = list(pool.map(_create_auth_user, valid))
+        
+        created = []
+        for spec, (user_id, err) in zip(valid, results):
+            if err:
+                failed.append({"username": spec['username'], "email": spec['email'], "error": err})
+            else:
+                created.append(dict(spec, user_id=user_id))
+        
+        # Overwrites whatever the sign-up trigger wrote (it stores the email prefix as username)
+        updated_at = datetime.now().isoformat()
+        provisioned = []
+        for start in range(0, len(created), BULK_CHUNK_SIZE):
+            chunk = created[start:start + BULK_CHUNK_SIZE]
+            upsert = _execute(supabase.table('user_profile').upsert([{
+                'user_id': spec['user_id'],
+                'username': spec['username'],
+                'current_points': spec['points'],
+                'user_status': 'active',
+                'updated_at': updated_at
+            } for spec in chunk], on_conflict='user_id'))
+            err = _resp_error(upsert)
+            for spec in chunk:
+                _profile_cache.invalidate(spec['user_id'])
+                if err:
+                    # The auth user exists; report its id so the profile can be repaired
+                    failed.append({"id": spec['user_id'], "username": spec['username'], "email": spec['email'], "error": f"Profile write failed: {err}"})
+                else:
+                    provisioned.append(spec)
+        
+        return jsonify({
+            "success": True,
+            "created": [{"id": spec['user_id'], "username": spec['username'], "email": spec['email']} for spec in provisioned],
+            "failed": failed,
+            "timestamp": datetime.now().isoformat()
+        }), 201 if provisioned else 200
+        
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        print(f"Bulk provision error: {e}")
+        return create_error_response(f"Failed to provision users: {str(e)}", 500)
+
+# Admin analytics
+ANALYTICS_DEADLINE_SECONDS = float(os.getenv('ANALYTICS_DEADLINE_SECONDS', '120'))
+
+@app.route('/api/admin/analytics/rtp', methods=['GET'])
+@jwt_required()
+@admin_required
+def rtp_analytics_report():
+    """Per-game and per-day RTP, hit frequency and payout percentiles (admin endpoint)"""
+    if not supabase:
+        return create_error_response("Database not configured", 503)
+    try:
+        # numpy is only needed by the analytics tooling, not by the API itself
+        import rtp_analytics
+    except ImportError as e:
+        return create_error_response(f"Analytics unavailable: {e}", 501)
+    
+    try:
+        # The database aggregates (rtp_rollup, migrations/0005) and returns one row per game, but
+        # the grouping still reads every round in range, which can outlive the normal budget
+        g.deadline = time.monotonic() + ANALYTICS_DEADLINE_SECONDS
+        try:
+            rows = rtp_analytics.fetch_rollup(
+                supabase,
+                since=request.args.get('since'),
+                until=request.args.get('until'),
+                game_id=request.args.get('game_id'),
+                # No hedging: a duplicate would redo the whole aggregation
+                execute=lambda query: _execute(query, timeout=ANALYTICS_DEADLINE_SECONDS)
+            )
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            if getattr(e, 'code', None) == 'PGRST202':  # function not found
+                return create_error_response("Analytics need migrations/0005_rtp_rollup.sql applied", 501)
+            raise
+        report = rtp_analytics.compute_rtp_rollup(rows)
+        
+        return jsonify({
+            "success": True,
+            **report,
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        print(f"RTP analytics error: {e}")
+        return create_error_response(f"Failed to compute analytics: {str(e)}", 500)
+
+# Process metrics (counters are per worker)
+@app.route('/api/metrics', methods=['GET'])
+@jwt_required()
+@admin_required
+def metrics():
+    """Rejection, shedding and upstream failure counters plus a few gauges (admin endpoint)"""
+    counters = _metrics.snapshot()
+    gauges = {
+        "stream.subscribers": _event_hub.subscriber_count(),
+        "upstream.in_flight": counters.pop('upstream.in_flight', 0),
+        "upstream.max_concurrency": UPSTREAM_MAX_CONCURRENCY,
+        "rate_limit.keys": sum(len(u) + len(i) for u, i in _rate_limiters.values()),
+    }
+    gauges.update({f"breaker.{name}.open": b.is_open() for name, b in _breakers.items()})
+    return jsonify({
+        "success": True,
+        "counters": counters,
+        "gauges": gauges,
+        "timestamp": datetime.now().isoformat()
+    })
+
+# Opt-in request profiling: a sampler thread records the stacks of the threads serving profiled
+# requests. A request is profiled when an admin sends "X-Profile: 1" or, with
+# REQUEST_PROFILE_SAMPLE_RATE > 0, by random sampling; otherwise the cost is one header lookup.
+# Time spent waiting on Supabase shows up under _call_upstream.
+REQUEST_PROFILE_SAMPLE_RATE = float(os.getenv('REQUEST_PROFILE_SAMPLE_RATE', '0'))
+REQUEST_PROFILE_INTERVAL_SECONDS = float(os.getenv('REQUEST_PROFILE_INTERVAL_SECONDS', '0.005'))
+REQUEST_PROFILE_KEEP = int(os.getenv('REQUEST_PROFILE_KEEP', '50'))
+# If set, every finished profile is also written there as <time>-<method>-<path>-<id>.folded
+REQUEST_PROFILE_DUMP_DIR = os.getenv('REQUEST_PROFILE_DUMP_DIR')
+REQUEST_PROFILE_MAX_DEPTH = 128
+
+class _RequestProfile:
+    """Sampled stacks of one request, in folded form ("outer;inner;leaf" -> sample count)."""
+
+    def __init__(self, method, path, trigger):
+        self.id = uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = datetime.now()
+        self.began = time.perf_counter()
+        self.duration_ms = None
+        self.status = None
+        self.samples = 0
+        self.stacks = {}
+
+    def folded(self):
+        """Input for flamegraph.pl, speedscope or inferno."""
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "trigger": self.trigger,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.duration_ms,
+            "samples": self.samples,
+        }
+
+class _SamplingProfiler:
+    """One sampler thread per process, running only while some request is being profiled."""
+
+    def __init__(self, interval, keep):
+        self.interval = interval
+        self.finished = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self._active = {}  # thread id -> _RequestProfile
+        self._wake = threading.Event()
+        self._thread = None
+        self._labels = {}  # code object -> "name (file:line)"
+
+    def start(self, profile):
+        with self._lock:
+            self._active[threading.get_ident()] = profile
+            # Also restarts the sampler in a forked worker, which inherits no threads
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return profile
+
+    def stop(self, status):
+        """Finish the calling thread's profile, if any, and return it."""
+        with self._lock:
+            profile = self._active.pop(threading.get_ident(), None)
+        if profile is None:
+            return None
+        profile.status = status
+        profile.duration_ms = round((time.perf_counter() - profile.began) * 1000, 3)
+        self.finished.append(profile)
+        _metrics.incr('profiler.profiles')
+        if REQUEST_PROFILE_DUMP_DIR:
+            self._dump(profile)
+        return profile
+
+    def get(self, profile_id):
+        for profile in list(self.finished):
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                targets = list(self._active.items())
+                if not targets:
+                    self._wake.clear()
+                    continue
+            frames = sys._current_frames()
+            sampled = []
+            for thread_id, profile in targets:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None and len(stack) < REQUEST_PROFILE_MAX_DEPTH:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    sampled.append((thread_id, profile, ';'.join(reversed(stack))))
+            del frames, frame
+            with self._lock:
+                for thread_id, profile, stack in sampled:
+                    # Skip profiles finished while we were walking their stacks
+                    if self._active.get(thread_id) is profile:
+                        profile.stacks[stack] = profile.stacks.get(stack, 0) + 1
+                        profile.samples += 1
+            time.sleep(self.interval)
+
+    def _dump(self, profile):
+        name = f"{profile.started_at:%Y%m%dT%H%M%S}-{profile.method}-{profile.path.strip('/').replace('/', '_') or 'root'}-{profile.id}.folded"
+        try:
+            os.makedirs(REQUEST_PROFILE_DUMP_DIR, exist_ok=True)
+            with open(os.path.join(REQUEST_PROFILE_DUMP_DIR, name), 'w') as f:
+                f.write(profile.folded())
+        except OSError as e:
+            print(f"Profile dump error: {e}")
+
+_profiler = _SamplingProfiler(REQUEST_PROFILE_INTERVAL_SECONDS, REQUEST_PROFILE_KEEP)
+
+def _read_profile_dump(profile_id):
+    """Folded stacks of a profile from REQUEST_PROFILE_DUMP_DIR, or None"""
+    if not REQUEST_PROFILE_DUMP_DIR or len(profile_id) != 12 or not all(c in '0123456789abcdef' for c in profile_id):
+        return None
+    for path in glob.glob(os.path.join(glob.escape(REQUEST_PROFILE_DUMP_DIR), f'*-{profile_id}.folded')):
+        try:
+            with open(path) as f:
+                return f.read()
+        except OSError:
+            continue
+    return None
+
+@app.before_request
+def _start_request_profile():
+    trigger = None
+    if request.headers.get('X-Profile'):
+        try:
+            verify_jwt_in_request(optional=True)
+            if _is_admin(get_jwt_identity()):
+                trigger = 'header'
+        except Exception:
+            pass
+    if trigger is None and REQUEST_PROFILE_SAMPLE_RATE and random.random() < REQUEST_PROFILE_SAMPLE_RATE:
+        trigger = 'sampled'
+    if trigger:
+        g.request_profile = _profiler.start(_RequestProfile(request.method, request.path, trigger))
+
+@app.after_request
+def _finish_request_profile(response):
+    # Streaming bodies are produced after this point, so only the view itself is profiled
+    if g.pop('request_profile', None) is not None:
+        profile = _profiler.stop(response.status_code)
+        if profile:
+            response.headers['X-Profile-Id'] = profile.id
+    return response
+
+@app.teardown_request
+def _abandon_request_profile(error):
+    # after_request is skipped when the view raised
+    if g.pop('request_profile', None) is not None:
+        _profiler.stop(500)
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@jwt_required()
+@admin_required
+def list_request_profiles():
+    """Recently finished request profiles of this worker, newest first (admin endpoint)"""
+    return jsonify({
+        "success": True,
+        "profiles": [profile.summary() for profile in reversed(list(_profiler.finished))],
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_request_profile(profile_id):
+    """One profile as folded stacks (text/plain), or with ?format=json as summary plus stacks (admin endpoint)"""
+    profile = _profiler.get(profile_id)
+    if not profile:
+        # Recorded by another worker (or already evicted here): serve its dump if there is one
+        dumped = _read_profile_dump(profile_id)
+        if dumped is None:
+            return create_error_response("Profile not found", 404)
+        if request.args.get('format') == 'json':
+            # A dump has only the stacks; the summary stayed with the worker that recorded it
+            stacks = {stack: int(count) for stack, count in (line.rsplit(' ', 1) for line in dumped.splitlines() if line)}
+            return jsonify({
+                "success": True,
+                "profile": {"id": profile_id, "samples": sum(stacks.values()), "stacks": stacks},
+                "timestamp": datetime.now().isoformat()
+            })
+        return Response(dumped, mimetype='text/plain')
+    if request.args.get('format') == 'json':
+        return jsonify({
+            "success": True,
+            "profile": dict(profile.summary(), stacks=profile.stacks),
+            "timestamp": datetime.now().isoformat()
+        })
+    return Response(profile.folded(), mimetype='text/plain')
+
 # Error handlers
+@app.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(error):
+    return _upstream_unavailable_response(error)
+
 @app.errorhandler(404)
 def not_found(error):
     return create_error_response("Endpoint not found", 404)
@@ -1006,5 +3440,62 @@ def not_found(error):
 def server_error(error):
     return create_error_response("Internal server error", 500)
 
+# Production server: preforked gunicorn workers, each serving requests from a thread pool.
+# Threads rather than more processes: handlers mostly wait on Supabase. Streams are held on each
+# worker's asyncio loop (_StreamServer), not on these threads.
+WEB_HOST = os.getenv('HOST', '0.0.0.0')
+WEB_PORT = int(os.getenv('PORT', '5000'))
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', str(os.cpu_count() or 1)))
+WEB_THREADS = int(os.getenv('WEB_THREADS', '32'))
+WEB_WORKER_CLASS = os.getenv('WEB_WORKER_CLASS', 'gthread')
+WEB_TIMEOUT_SECONDS = int(os.getenv('WEB_TIMEOUT_SECONDS', '30'))
+
+def _init_worker(server, worker):
+    # Forked workers inherit the master's random state; reward codes must not repeat across workers
+    random.seed()
+    _stream_bus.start(_deliver_balance_change)
+    _stream_server.start()
+
+def serve_production():
+    """Run under gunicorn (pip install gunicorn); only this launch mode needs it."""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("Production mode requires gunicorn: pip install gunicorn")
+
+    options = {
+        'bind': f"{WEB_HOST}:{WEB_PORT}",
+        'workers': WEB_WORKERS,
+        'worker_class': WEB_WORKER_CLASS,
+        'threads': WEB_THREADS,
+        'timeout': WEB_TIMEOUT_SECONDS,
+        'graceful_timeout': WEB_TIMEOUT_SECONDS,
+        'keepalive': 5,
+        'post_fork': _init_worker,
+        'accesslog': '-',
+        # %(U)s is the path without its query string, which may hold a stream token
+        'access_log_format': '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"',
+    }
+
+    class _Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    # Each profile is only in the memory of the worker that recorded it; dumping them to the shared
+    # directory lets whichever worker gets GET /api/admin/profiles/<id> serve it
+    global REQUEST_PROFILE_DUMP_DIR
+    if not REQUEST_PROFILE_DUMP_DIR:
+        REQUEST_PROFILE_DUMP_DIR = os.path.join(SHARED_CACHE_DIR, f'placebo-{APP_INSTANCE_ID}-profiles')
+
+    print(f"Serving on {options['bind']} with {WEB_WORKERS} {WEB_WORKER_CLASS} workers x {WEB_THREADS} threads, streams on port {STREAM_PORT}")
+    _Server().run()
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    if '--prod' in sys.argv[1:] or os.getenv('APP_ENV') == 'production':
+        serve_production()
+    else:
+        app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,269 @@
+"""Monte Carlo blackjack simulator for predicting what a payout or rule change does to the economy.
+
+Hands are played in large NumPy batches, each from its own freshly shuffled shoe as the client
+deals them, across worker processes. The report gives the expected RTP, outcome frequencies and
+the spread of session balances for a flat bettor. Defaults follow the client game: one deck,
+dealer stands on soft 17, no hole-card peek, naturals pay 3:2, hit/stand only.
+
+    python blackjack_sim.py --sessions 100000 --decks 6 --h17 --payout 1.2
+    python rtp_analytics.py --json > rtp.json && python blackjack_sim.py --compare rtp.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Card ranks are indexed by value - 1: ace, 2-9, then all ten-valued cards
+RANKS = 10
+OUTCOMES = ('loss', 'push', 'win', 'blackjack')
+LOSS, PUSH, WIN, BLACKJACK = range(len(OUTCOMES))
+BATCH_HANDS = 250000
+MAX_DECKS = 8
+SESSION_PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+DEFAULT_RULES = {
+    'decks': 1,
+    'h17': False,          # dealer hits soft 17
+    'peek': False,         # dealer checks for blackjack before the player acts
+    'payout': 1.5,         # net paid per point on a natural (BLACKJACK_PAYOUT in the API)
+    'strategy': 'basic',   # 'basic' hit/stand chart, or 'threshold' (hit below stand_on)
+    'stand_on': 17,
+}
+
+
+def shoe_counts(decks):
+    # int16 keeps the per-draw cumsum narrow; MAX_DECKS bounds the running sum
+    counts = np.full(RANKS, 4 * decks, dtype=np.int16)
+    counts[9] = 16 * decks
+    return counts
+
+
+class _Hands:
+    """Hard totals (aces counted as 1) and ace flags for a batch of hands."""
+
+    def __init__(self, n):
+        self.total = np.zeros(n, dtype=np.int64)
+        self.aces = np.zeros(n, dtype=bool)
+
+    def add(self, rows, cards):
+        self.total[rows] += cards
+        self.aces[rows] |= cards == 1
+
+    def value(self, rows=slice(None)):
+        total = self.total[rows]
+        return np.where(self.aces[rows] & (total <= 11), total + 10, total)
+
+    def soft(self, rows=slice(None)):
+        return self.aces[rows] & (self.total[rows] <= 11)
+
+
+def _draw(rng, shoe, rows):
+    """Deal one card to each hand in rows from that hand's own shoe; returns card values 1-10."""
+    cum = shoe[rows].cumsum(axis=1, dtype=np.int16)
+    pick = rng.integers(0, cum[:, -1], dtype=np.int16)
+    ranks = (cum <= pick[:, None]).sum(axis=1, dtype=np.int64)
+    shoe[rows, ranks] -= 1
+    return ranks + 1
+
+
+def _player_hits(value, soft, upcard, rules):
+    if rules['strategy'] == 'threshold':
+        return value < rules['stand_on']
+    up = np.where(upcard == 1, 11, upcard)
+    hard_hit = (value <= 11) | ((value == 12) & ((up < 4) | (up > 6))) | ((value <= 16) & (up >= 7))
+    soft_hit = (value <= 17) | ((value == 18) & (up >= 9))
+    return np.where(soft, soft_hit, hard_hit)
+
+
+def play_hands(rng, n, rules):
+    """Play n independent hands; returns the outcome code of each (see OUTCOMES)."""
+    shoe = np.tile(shoe_counts(rules['decks']), (n, 1))
+    everyone = np.arange(n)
+    player, dealer = _Hands(n), _Hands(n)
+    player.add(everyone, _draw(rng, shoe, everyone))
+    upcard = _draw(rng, shoe, everyone)
+    dealer.add(everyone, upcard)
+    player.add(everyone, _draw(rng, shoe, everyone))
+    dealer.add(everyone, _draw(rng, shoe, everyone))
+
+    player_natural = player.value() == 21
+    dealer_natural = dealer.value() == 21
+    settled = player_natural | (dealer_natural if rules['peek'] else False)
+
+    # Player hits until the strategy stands, the hand busts or it reaches 21
+    rows = np.nonzero(~settled)[0]
+    while len(rows):
+        rows = rows[_player_hits(player.value(rows), player.soft(rows), upcard[rows], rules)]
+        if not len(rows):
+            break
+        player.add(rows, _draw(rng, shoe, rows))
+        rows = rows[player.value(rows) < 21]
+
+    # Dealer draws only against live hands
+    player_value = player.value()
+    rows = np.nonzero(~settled & (player_value <= 21))[0]
+    while len(rows):
+        value = dealer.value(rows)
+        draws = (value < 17) | ((value == 17) & dealer.soft(rows) & rules['h17'])
+        rows = rows[draws]
+        if not len(rows):
+            break
+        dealer.add(rows, _draw(rng, shoe, rows))
+
+    dealer_value = dealer.value()
+    outcome = np.sign(player_value - dealer_value) + PUSH
+    outcome[dealer_value > 21] = WIN
+    outcome[player_value > 21] = LOSS
+    if rules['peek']:
+        outcome[dealer_natural] = LOSS
+    outcome[player_natural] = np.where(dealer_natural[player_natural], PUSH, BLACKJACK)
+    return outcome.astype(np.int8)
+
+
+def hand_payouts(bet, rules):
+    """Net points per outcome for a flat bet, rounded down like the client pays naturals."""
+    return np.array([-bet, 0, bet, int(bet * rules['payout'])], dtype=np.int64)
+
+
+def simulate_sessions(seed, sessions, hands_per_session, bet, start_balance, rules):
+    """Worker: play sessions of flat bets; returns outcome counts and final session balances.
+
+    A session stops at the first hand the balance can no longer cover; every hand still counts
+    towards the outcome totals, which only describe the game.
+    """
+    rng = np.random.default_rng(seed)
+    payouts = hand_payouts(bet, rules)
+    counts = np.zeros(len(OUTCOMES), dtype=np.int64)
+    finals = np.empty(sessions, dtype=np.int64)
+    busted = 0
+    per_batch = max(1, BATCH_HANDS // hands_per_session)
+    for start in range(0, sessions, per_batch):
+        n = min(per_batch, sessions - start)
+        outcome = play_hands(rng, n * hands_per_session, rules)
+        counts += np.bincount(outcome, minlength=len(OUTCOMES))
+        balance = start_balance + payouts[outcome].reshape(n, hands_per_session).cumsum(axis=1)
+        broke = balance < bet
+        went_broke = broke.any(axis=1)
+        stop = np.where(went_broke, broke.argmax(axis=1), hands_per_session - 1)
+        finals[start:start + n] = balance[np.arange(n), stop]
+        busted += int(went_broke.sum())
+    return counts, finals, busted
+
+
+def simulate(rules, sessions, hands_per_session, bet, start_balance, workers=None, seed=None):
+    """Spread sessions over worker processes with independent streams; returns the report dict."""
+    workers = max(1, min(workers or os.cpu_count() or 1, sessions))
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    shares = [sessions // workers + (i < sessions % workers) for i in range(workers)]
+    began = time.perf_counter()
+    if workers == 1:
+        results = [simulate_sessions(seeds[0], sessions, hands_per_session, bet, start_balance, rules)]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(simulate_sessions, seeds, shares, [hands_per_session] * workers,
+                                    [bet] * workers, [start_balance] * workers, [rules] * workers))
+    elapsed = time.perf_counter() - began
+
+    counts = sum(r[0] for r in results)
+    finals = np.concatenate([r[1] for r in results])
+    busted = sum(r[2] for r in results)
+    hands = int(counts.sum())
+    freq = counts / hands
+    multipliers = hand_payouts(bet, rules) / bet
+    mean = float(freq @ multipliers)
+    std = float(np.sqrt(freq @ (multipliers - mean) ** 2))
+    return {
+        "rules": rules,
+        "hands": hands,
+        "bet": bet,
+        "rtp": 1 + mean,
+        "house_edge": -mean,
+        "std_per_hand": std,
+        "outcomes": {name: float(f) for name, f in zip(OUTCOMES, freq)},
+        "session": {
+            "sessions": sessions,
+            "hands_per_session": hands_per_session,
+            "start_balance": start_balance,
+            "mean_final": float(finals.mean()),
+            "busted": busted / sessions,
+            **{f"p{p}": float(v) for p, v in zip(SESSION_PERCENTILES, np.percentile(finals, SESSION_PERCENTILES))},
+        },
+        "hands_per_second": hands / elapsed if elapsed else None,
+    }
+
+
+def compare(report, analytics, game_id=None):
+    """Observed RTP per game from an rtp_analytics report against the simulated expectation.
+
+    z is the observed deviation in standard errors of the simulated per-hand spread; |z| above
+    about 3 means the live game does not play like the simulated rules.
+    """
+    rows = []
+    for game in analytics.get('games', []):
+        if game_id and game['game_id'] != game_id:
+            continue
+        if not game['rounds'] or game['rtp'] is None:
+            continue
+        stderr = report['std_per_hand'] / np.sqrt(game['rounds'])
+        rows.append({
+            "game_id": game['game_id'],
+            "rounds": game['rounds'],
+            "observed_rtp": game['rtp'],
+            "expected_rtp": report['rtp'],
+            "z": (game['rtp'] - report['rtp']) / stderr if stderr else None,
+        })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo blackjack RTP and balance simulator")
+    parser.add_argument('--decks', type=int, default=DEFAULT_RULES['decks'])
+    parser.add_argument('--h17', action='store_true', help="dealer hits soft 17")
+    parser.add_argument('--peek', action='store_true', help="dealer peeks for blackjack; a dealer natural wins at once")
+    parser.add_argument('--payout', type=float, default=DEFAULT_RULES['payout'], help="net paid per point on a natural")
+    parser.add_argument('--strategy', choices=('basic', 'threshold'), default=DEFAULT_RULES['strategy'])
+    parser.add_argument('--stand-on', type=int, default=DEFAULT_RULES['stand_on'], help="threshold strategy: stand on this value or more")
+    parser.add_argument('--bet', type=int, default=10, help="flat bet in points, e.g. the game's min_bet_points")
+    parser.add_argument('--start-balance', type=int, default=1000)
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--hands-per-session', type=int, default=100)
+    parser.add_argument('--workers', type=int, help="worker processes (default: all cores)")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--compare', help="rtp_analytics.py --json output to compare against")
+    parser.add_argument('--game-id', help="with --compare, only this game")
+    parser.add_argument('--json', action='store_true', help="print the full report as JSON")
+    args = parser.parse_args(argv)
+    if not 1 <= args.decks <= MAX_DECKS:
+        parser.error(f"--decks must be between 1 and {MAX_DECKS}")
+    if args.bet < 1 or args.sessions < 1 or args.hands_per_session < 1:
+        parser.error("--bet, --sessions and --hands-per-session must be positive")
+
+    rules = dict(DEFAULT_RULES, decks=args.decks, h17=args.h17, peek=args.peek, payout=args.payout,
+                 strategy=args.strategy, stand_on=args.stand_on)
+    report = simulate(rules, args.sessions, args.hands_per_session, args.bet, args.start_balance,
+                      workers=args.workers, seed=args.seed)
+    if args.compare:
+        with open(args.compare) as f:
+            report['comparison'] = compare(report, json.load(f), args.game_id)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    s = report['session']
+    print(f"{report['hands']} hands at {report['hands_per_second'] or 0:,.0f} hands/s")
+    print(f"RTP {report['rtp']:.4f}  house edge {report['house_edge']:.4f}  std/hand {report['std_per_hand']:.3f}")
+    print("  ".join(f"{name} {f * 100:.2f}%" for name, f in report['outcomes'].items()))
+    print(f"{s['sessions']} sessions of {s['hands_per_session']} x {args.bet} from {s['start_balance']}: "
+          f"mean {s['mean_final']:.1f}, p5 {s['p5']:.0f}, p50 {s['p50']:.0f}, p95 {s['p95']:.0f}, busted {s['busted'] * 100:.2f}%")
+    for row in report.get('comparison', []):
+        print(f"{row['game_id']:38} {row['rounds']:>10} observed {row['observed_rtp']:.4f} "
+              f"expected {row['expected_rtp']:.4f} z {row['z']:+.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""EXPLAIN each query shape app_supabase.py sends and fail if any sequentially scans a large table.
+
+The queries are the SQL that PostgREST generates for the app's filters, orders and embeds, bound
+to sample values taken from the database. Run it against a local Postgres that has
+migrations/local_schema.sql and the numbered migrations applied, seeded to a realistic size. On
+small tables the planner rightly prefers sequential scans, so those tables are not flagged:
+
+    python seed_dataset.py --target postgres --dsn "$DATABASE_URL" --users 100000 --rounds 2000000
+    python check_query_plans.py --dsn "$DATABASE_URL"
+
+Exits with status 1 if any query sequentially scans a table with more than --min-rows rows.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from uuid import UUID
+
+TABLES = ('user_profile', 'game', 'round', 'reward', 'reward_redemption', 'point_transaction', 'idempotency_key')
+NIL_UUID = UUID(int=0)
+
+# (name, SQL, full_scan). full_scan marks queries that read a whole table on purpose, which are reported but never fail.
+QUERIES = [
+    ('profile_by_id', "select * from public.user_profile where user_id = %(user_id)s", False),
+    ('profile_update', "update public.user_profile set current_points = 0, updated_at = now() where user_id = %(user_id)s", False),
+    ('username_lookup', "select user_id from public.user_profile where username = %(username)s", False),
+    ('username_bulk_check', "select username from public.user_profile where username = any(%(usernames)s)", False),
+    ('leaderboard', """
+        select user_id, username, current_points from public.user_profile
+        where user_status = 'active' order by current_points desc limit 100""", False),
+    ('leaderboard_games_played', """
+        select user_id, count(*) from public.round where user_id = any(%(user_ids)s) group by user_id""", False),
+    ('history_page', """
+        select r.round_id, r.played_at, r.points_used, r.round_result, r.points_change, r.balance_after,
+               r.round_data, g.game_name, g.game_type
+        from public.round r
+        left join lateral (select game_name, game_type from public.game where game.game_id = r.game_id) g on true
+        where r.user_id = %(user_id)s order by r.played_at desc limit 50 offset 0""", False),
+    ('history_count', "select count(*) from public.round where user_id = %(user_id)s", False),
+    ('history_export_page', """
+        select r.round_id, r.played_at, r.points_used, r.round_result, r.points_change, r.balance_after,
+               r.round_data, g.game_name, g.game_type
+        from public.round r
+        left join lateral (select game_name, game_type from public.game where game.game_id = r.game_id) g on true
+        where r.user_id = %(user_id)s
+          and (r.played_at < %(played_at)s or (r.played_at = %(played_at)s and r.round_id < %(round_id)s))
+        order by r.played_at desc, r.round_id desc limit 1000""", False),
+    ('user_stats', "select round_result, points_change from public.round where user_id = %(user_id)s", False),
+    ('analytics_page', """
+        select round_id, game_id, points_used, points_change, round_result, played_at from public.round
+        where played_at >= %(since)s
+          and (played_at > %(played_at)s or (played_at = %(played_at)s and round_id > %(round_id)s))
+        order by played_at, round_id limit 1000""", False),
+    ('analytics_game_page', """
+        select round_id, game_id, points_used, points_change, round_result, played_at from public.round
+        where game_id = %(game_id)s and played_at >= %(since)s
+          and (played_at > %(played_at)s or (played_at = %(played_at)s and round_id > %(round_id)s))
+        order by played_at, round_id limit 1000""", False),
+    # The grouping inside rtp_rollup (migrations/0005) reads every round in range on purpose
+    ('analytics_rollup', """
+        select game_id, (played_at at time zone 'UTC')::date, count(*), sum(points_used), sum(points_change)
+        from public.round where played_at >= %(since)s
+        group by grouping sets ((game_id), (game_id, (played_at at time zone 'UTC')::date))""", True),
+    ('reward_by_code', "select * from public.reward where reward_name ilike %(code_pattern)s and is_active = true", False),
+    ('reward_decrement', "update public.reward set quantity_in_stock = quantity_in_stock - 1 where reward_id = %(reward_id)s", False),
+    ('redemption_exists', """
+        select * from public.reward_redemption where user_id = %(user_id)s and reward_id = %(reward_id)s""", False),
+    ('games_by_status', "select * from public.game where game_status = 'waiting'", False),
+    ('game_by_name', "select * from public.game where game_name = 'Blackjack'", False),
+    ('game_by_type', "select * from public.game where game_type = 'blackjack'", False),
+    ('idempotency_key', """
+        select * from public.idempotency_key where user_id = %(user_id)s and idempotency_key = 'check'""", False),
+    # What the foreign key triggers run when a round, profile or redemption is deleted
+    ('fk_point_transaction_round', "select 1 from public.point_transaction where round_id = %(round_id)s", False),
+    ('fk_point_transaction_user', "select 1 from public.point_transaction where user_id = %(user_id)s", False),
+    ('fk_point_transaction_redemption', "select 1 from public.point_transaction where redemption_id = %(redemption_id)s", False),
+    ('fk_round_user', "select 1 from public.round where user_id = %(user_id)s", False),
+    ('fk_redemption_user', "select 1 from public.reward_redemption where user_id = %(user_id)s", False),
+    ('game_catalog', "select * from public.game", True),
+    ('health_count', "select count(*) from public.user_profile", True),
+]
+
+
+def sample_params(cur):
+    """Bind values for QUERIES, taken from existing rows where there are any."""
+    cur.execute("select user_id, game_id, played_at, round_id from public.round limit 1")
+    row = cur.fetchone()
+    if row:
+        user_id, game_id, played_at, round_id = row
+    else:
+        cur.execute("select user_id from public.user_profile limit 1")
+        found = cur.fetchone()
+        user_id, game_id, played_at, round_id = found[0] if found else NIL_UUID, NIL_UUID, datetime.now(timezone.utc), NIL_UUID
+    cur.execute("select username from public.user_profile where user_id = %s", (user_id,))
+    found = cur.fetchone()
+    username = found[0] if found else 'player'
+    cur.execute("select reward_id from public.reward limit 1")
+    reward = cur.fetchone()
+    cur.execute("select redemption_id from public.reward_redemption limit 1")
+    redemption = cur.fetchone()
+    return {
+        'user_id': user_id,
+        'username': username,
+        'usernames': [username] + [f'{username}-{i}' for i in range(199)],
+        'user_ids': [user_id] + [UUID(int=i) for i in range(1, 100)],
+        'game_id': game_id or NIL_UUID,
+        'played_at': played_at,
+        'round_id': round_id,
+        'since': played_at,
+        'reward_id': reward[0] if reward else NIL_UUID,
+        'redemption_id': redemption[0] if redemption else NIL_UUID,
+        'code_pattern': '%PLC7Q2XK%',
+    }
+
+
+def iter_nodes(node):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from iter_nodes(child)
+
+
+def describe(node):
+    relation = node.get('Relation Name')
+    index = node.get('Index Name')
+    if index:
+        return f"{node['Node Type']} using {index} on {relation}"
+    return f"{node['Node Type']} on {relation}" if relation else node['Node Type']
+
+
+def table_rows(cur):
+    """Planner row estimates per table; -1 (never analyzed) counts as unknown."""
+    cur.execute("select relname, reltuples::bigint from pg_class where relnamespace = 'public'::regnamespace and relkind = 'r'")
+    return dict(cur.fetchall())
+
+
+def check(conn, min_rows, analyze=True, show_plans=False):
+    """EXPLAIN every query; return the list of (name, table, rows) sequential scans over min_rows."""
+    failures = []
+    with conn.cursor() as cur:
+        if analyze:
+            for table in TABLES:
+                cur.execute("select to_regclass(%s)", (f'public.{table}',))
+                if cur.fetchone()[0]:
+                    cur.execute(f'analyze public.{table}')
+            conn.commit()
+        rows = table_rows(cur)
+        params = sample_params(cur)
+        for name, sql, full_scan in QUERIES:
+            cur.execute('explain (format json) ' + sql, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            root = plan[0]['Plan']
+            scans = [n for n in iter_nodes(root) if 'Relation Name' in n]
+            flagged = [n for n in scans if n['Node Type'] == 'Seq Scan' and rows.get(n['Relation Name'], -1) > min_rows]
+            if flagged and full_scan:
+                status = 'full'
+            elif flagged:
+                status = 'SEQ'
+                failures.extend((name, n['Relation Name'], rows[n['Relation Name']]) for n in flagged)
+            else:
+                status = 'ok'
+            print(f"{status:4} {name:32} {'; '.join(describe(n) for n in scans) or describe(root)}")
+            if show_plans:
+                print(json.dumps(root, indent=2))
+        # EXPLAIN never runs the updates, but leave nothing open either way
+        conn.rollback()
+    unknown = sorted(t for t in TABLES if rows.get(t, 0) < 0)
+    if unknown:
+        print(f"warning: no statistics for {', '.join(unknown)}; run ANALYZE or drop --no-analyze", file=sys.stderr)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail if an app query shape sequentially scans a large table")
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'), help="Postgres connection string (default: DATABASE_URL)")
+    parser.add_argument('--min-rows', type=int, default=10000, help="tables at or below this many rows may be scanned")
+    parser.add_argument('--no-analyze', action='store_true', help="use the existing planner statistics")
+    parser.add_argument('--show-plans', action='store_true', help="print each plan as JSON")
+    args = parser.parse_args(argv)
+    if not args.dsn:
+        parser.error("--dsn or DATABASE_URL is required")
+
+    import psycopg
+    with psycopg.connect(args.dsn) as conn:
+        failures = check(conn, args.min_rows, analyze=not args.no_analyze, show_plans=args.show_plans)
+    if failures:
+        print(f"\n{len(failures)} sequential scan(s) over tables larger than {args.min_rows} rows:")
+        for name, table, rows in failures:
+            print(f"  {name}: {table} (~{rows} rows)")
+        print("Apply migrations/0002_query_indexes.sql, or add an index for the query shape above.")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
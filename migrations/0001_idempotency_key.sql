@@ -0,0 +1,20 @@
+-- Durable Idempotency-Key records for write endpoints (see _IdempotencyStore in app_supabase.py).
+-- The primary key makes a key claimable by exactly one request per user across all workers.
+create table if not exists public.idempotency_key (
+  user_id uuid not null references auth.users (id) on delete cascade,
+  idempotency_key text not null check (char_length(idempotency_key) <= 255),
+  request_hash text not null,
+  status text not null default 'pending' check (status in ('pending', 'completed')),
+  response_code integer,
+  response_body jsonb,
+  created_at timestamptz not null default now(),
+  completed_at timestamptz,
+  primary key (user_id, idempotency_key)
+);
+
+-- Expired keys are taken over on reuse; this index lets a scheduled job purge them, e.g.
+--   delete from public.idempotency_key where created_at < now() - interval '1 day';
+create index if not exists idempotency_key_created_at_idx on public.idempotency_key (created_at);
+
+-- Only the service role (the Flask API) reads or writes this table
+alter table public.idempotency_key enable row level security;
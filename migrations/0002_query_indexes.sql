@@ -0,0 +1,40 @@
+-- Indexes for the query shapes app_supabase.py sends through PostgREST. check_query_plans.py runs
+-- EXPLAIN on each of those shapes and fails if any of them falls back to a sequential scan.
+-- On a large live database, build them one at a time with `create index concurrently` instead.
+create extension if not exists pg_trgm;
+
+-- Game history page, per-user stats and round counts: user_id = $1 order by played_at desc. The
+-- history export pages on (played_at, round_id) descending, so round_id is part of the key.
+create index if not exists round_user_played_at_idx
+  on public.round (user_id, played_at desc, round_id desc);
+
+-- RTP analytics pages on (played_at, round_id) over all rounds, or within one game
+create index if not exists round_played_at_idx on public.round (played_at, round_id);
+create index if not exists round_game_played_at_idx on public.round (game_id, played_at, round_id);
+
+-- Login by username, the registration duplicate check and bulk provisioning's `username in (...)`.
+-- Not unique: uniqueness is checked by the API, and existing rows may already collide.
+create index if not exists user_profile_username_idx on public.user_profile (username);
+
+-- Leaderboard: user_status = 'active' order by current_points desc limit N
+create index if not exists user_profile_status_points_idx
+  on public.user_profile (user_status, current_points desc);
+
+-- Redeem: one redemption per (user, reward); also covers the user_id foreign key
+create index if not exists reward_redemption_user_reward_idx
+  on public.reward_redemption (user_id, reward_id);
+
+-- Redeem looks rewards up with reward_name ilike '%<code>%', which only a trigram index can serve
+create index if not exists reward_name_trgm_idx on public.reward using gin (reward_name gin_trgm_ops);
+
+-- The API reads the whole game catalog and filters it in memory; these cover direct lookups by
+-- name or type and the /api/games?status= filter
+create index if not exists game_name_idx on public.game (game_name);
+create index if not exists game_type_idx on public.game (game_type);
+create index if not exists game_status_idx on public.game (game_status);
+
+-- Foreign keys into point_transaction: deleting a round or profile cascades through these, and
+-- deleting a redemption has to check them
+create index if not exists point_transaction_round_idx on public.point_transaction (round_id);
+create index if not exists point_transaction_user_idx on public.point_transaction (user_id, created_at desc);
+create index if not exists point_transaction_redemption_idx on public.point_transaction (redemption_id);
@@ -0,0 +1,20 @@
+-- Games played per user for the leaderboard in one grouped query, instead of one count per row.
+-- Called as supabase.rpc('round_counts', {'user_ids': [...]}); served by round_user_played_at_idx (0002).
+create or replace function public.round_counts(user_ids uuid[])
+returns table (user_id uuid, games_played bigint)
+language sql
+stable
+as $$
+  select r.user_id, count(*) from public.round r where r.user_id = any(user_ids) group by r.user_id;
+$$;
+
+-- Only the service role (the Flask API) calls it; the Supabase roles are absent on a local stand-in
+revoke execute on function public.round_counts(uuid[]) from public;
+do $$
+begin
+  if exists (select 1 from pg_roles where rolname = 'service_role') then
+    revoke execute on function public.round_counts(uuid[]) from anon, authenticated;
+    grant execute on function public.round_counts(uuid[]) to service_role;
+  end if;
+end
+$$;
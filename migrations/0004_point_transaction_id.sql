@@ -0,0 +1,13 @@
+-- The ledger write-behind (LEDGER_WRITE_BEHIND, _LedgerJournal in app_supabase.py) generates
+-- transaction_id client-side and upserts with on_conflict=transaction_id, so a replayed batch is
+-- ignored instead of duplicated. That needs the column to accept client values and to carry a
+-- unique index; no-ops where transaction_id is already the primary key (migrations/local_schema.sql).
+create extension if not exists pgcrypto;
+
+alter table public.point_transaction add column if not exists transaction_id uuid;
+alter table public.point_transaction alter column transaction_id set default gen_random_uuid();
+update public.point_transaction set transaction_id = gen_random_uuid() where transaction_id is null;
+alter table public.point_transaction alter column transaction_id set not null;
+
+create unique index if not exists point_transaction_transaction_id_key
+  on public.point_transaction (transaction_id);
@@ -0,0 +1,91 @@
+-- Grouped round totals for the RTP report (rtp_analytics.fetch_rollup). The rounds are aggregated
+-- in one pass here and only one row per game comes back, so a report over tens of millions of
+-- rounds transfers a few kilobytes instead of every round. Each row carries:
+--   totals:  rounds, wagered, net, hits (points_change > 0), mult_sum and mult_sumsq
+--   results: {round_result: rounds}
+--   bin_index / bin_rounds: the payout histogram on rtp_analytics' MULTIPLIER_* grid, which the caller
+--            passes in (bin 0 and bins + 1 catch the tails); rounds without a stake have no bin
+--   days / day_rounds / day_wagered / day_net: per UTC day
+create or replace function public.rtp_rollup(
+  since timestamptz default null,
+  until timestamptz default null,
+  game uuid default null,
+  mult_min float8 default -5,
+  mult_max float8 default 5,
+  bins integer default 2000
+)
+returns table (
+  game_id uuid,
+  rounds bigint,
+  wagered numeric,
+  net numeric,
+  hits bigint,
+  mult_sum float8,
+  mult_sumsq float8,
+  results jsonb,
+  bin_index integer[],
+  bin_rounds bigint[],
+  days date[],
+  day_rounds bigint[],
+  day_wagered numeric[],
+  day_net numeric[]
+)
+language sql
+stable
+as $$
+  with scoped as (
+    select r.game_id,
+           (r.played_at at time zone 'UTC')::date as played_day,
+           r.round_result,
+           r.points_used,
+           r.points_change,
+           m.mult,
+           least(greatest(floor((m.mult - mult_min) / (mult_max - mult_min) * bins)::int + 1, 0), bins + 1) as bin
+    from public.round r
+    cross join lateral (select case when r.points_used > 0 then r.points_change::float8 / r.points_used end as mult) m
+    where (since is null or r.played_at >= since)
+      and (until is null or r.played_at < until)
+      and (game is null or r.game_id = game)
+  ),
+  -- kind: 7 = per game, 3 = per (game, day), 5 = per (game, result), 6 = per (game, bin)
+  grouped as (
+    select grouping(s.played_day, s.round_result, s.bin) as kind,
+           s.game_id, s.played_day, s.round_result, s.bin,
+           count(*) as n,
+           sum(s.points_used) as wagered,
+           sum(s.points_change) as net,
+           count(*) filter (where s.points_change > 0) as hits,
+           sum(s.mult) as mult_sum,
+           sum(s.mult * s.mult) as mult_sumsq
+    from scoped s
+    group by grouping sets ((s.game_id), (s.game_id, s.played_day), (s.game_id, s.round_result), (s.game_id, s.bin))
+  )
+  select g.game_id,
+         sum(g.n) filter (where g.kind = 7)::bigint,
+         sum(g.wagered) filter (where g.kind = 7),
+         sum(g.net) filter (where g.kind = 7),
+         sum(g.hits) filter (where g.kind = 7)::bigint,
+         sum(g.mult_sum) filter (where g.kind = 7),
+         sum(g.mult_sumsq) filter (where g.kind = 7),
+         coalesce(jsonb_object_agg(g.round_result, g.n) filter (where g.kind = 5 and g.round_result is not null), '{}'),
+         array_agg(g.bin order by g.bin) filter (where g.kind = 6 and g.bin is not null),
+         array_agg(g.n order by g.bin) filter (where g.kind = 6 and g.bin is not null),
+         array_agg(g.played_day order by g.played_day) filter (where g.kind = 3),
+         array_agg(g.n order by g.played_day) filter (where g.kind = 3),
+         array_agg(g.wagered order by g.played_day) filter (where g.kind = 3),
+         array_agg(g.net order by g.played_day) filter (where g.kind = 3)
+  from grouped g
+  group by g.game_id
+  order by g.game_id
+$$;
+
+-- Only the service role (the Flask API and the CLI) calls it; the Supabase roles are absent on a local stand-in
+revoke execute on function public.rtp_rollup(timestamptz, timestamptz, uuid, float8, float8, integer) from public;
+do $$
+begin
+  if exists (select 1 from pg_roles where rolname = 'service_role') then
+    revoke execute on function public.rtp_rollup(timestamptz, timestamptz, uuid, float8, float8, integer) from anon, authenticated;
+    grant execute on function public.rtp_rollup(timestamptz, timestamptz, uuid, float8, float8, integer) to service_role;
+  end if;
+end
+$$;
@@ -0,0 +1,86 @@
+-- Local Postgres stand-in for the Supabase schema: the tables and columns app_supabase.py reads
+-- and writes, for seed_dataset.py --target postgres and query-plan work without a Supabase project.
+-- Apply before the numbered migrations:
+--   psql "$DATABASE_URL" -f migrations/local_schema.sql -f migrations/0001_idempotency_key.sql \
+--     -f migrations/0002_query_indexes.sql -f migrations/0003_round_counts.sql \
+--     -f migrations/0004_point_transaction_id.sql -f migrations/0005_rtp_rollup.sql
+
+create extension if not exists pgcrypto;
+
+-- Supabase owns auth.users; only the columns the app relies on are modelled here
+create schema if not exists auth;
+
+create table if not exists auth.users (
+  id uuid primary key default gen_random_uuid(),
+  email text unique not null,
+  raw_user_meta_data jsonb not null default '{}',
+  created_at timestamptz not null default now()
+);
+
+create table if not exists public.user_profile (
+  user_id uuid primary key references auth.users (id) on delete cascade,
+  username text not null,
+  current_points integer not null default 1000 check (current_points >= 0),
+  user_status text not null default 'active',
+  created_at timestamptz not null default now(),
+  updated_at timestamptz not null default now()
+);
+
+create table if not exists public.game (
+  game_id uuid primary key default gen_random_uuid(),
+  game_name text not null,
+  game_type text not null,
+  game_status text not null default 'waiting',
+  min_bet_points integer not null default 10,
+  created_at timestamptz not null default now()
+);
+
+create table if not exists public.round (
+  round_id uuid primary key default gen_random_uuid(),
+  user_id uuid not null references public.user_profile (user_id) on delete cascade,
+  game_id uuid references public.game (game_id),
+  points_used integer not null check (points_used > 0),
+  round_result text not null check (round_result in ('win', 'loss', 'push', 'blackjack')),
+  points_change integer not null,
+  balance_after integer not null,
+  round_data jsonb not null default '{}',
+  played_at timestamptz not null default now()
+);
+
+create table if not exists public.reward (
+  reward_id uuid primary key default gen_random_uuid(),
+  reward_name text not null,
+  reward_description text,
+  reward_type text,
+  point_cost integer not null default 0,
+  point_amount integer not null default 0,
+  is_active boolean not null default true,
+  quantity_in_stock integer not null default 0,
+  created_at timestamptz not null default now()
+);
+
+create table if not exists public.reward_redemption (
+  redemption_id uuid primary key default gen_random_uuid(),
+  user_id uuid not null references public.user_profile (user_id) on delete cascade,
+  reward_id uuid not null references public.reward (reward_id),
+  points_spent integer not null default 0,
+  redemption_code text,
+  redemption_status text not null default 'issued',
+  created_at timestamptz not null default now()
+);
+
+create table if not exists public.point_transaction (
+  transaction_id uuid primary key default gen_random_uuid(),
+  user_id uuid not null references public.user_profile (user_id) on delete cascade,
+  transaction_type text not null,
+  transaction_change integer not null,
+  balance_after integer not null,
+  round_id uuid references public.round (round_id) on delete cascade,
+  redemption_id uuid references public.reward_redemption (redemption_id),
+  description text,
+  created_at timestamptz not null default now()
+);
+
+insert into public.game (game_name, game_type, game_status, min_bet_points)
+select 'Blackjack', 'blackjack', 'waiting', 10
+where not exists (select 1 from public.game where game_type = 'blackjack');
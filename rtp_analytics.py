@@ -0,0 +1,398 @@
+"""Per-game return-to-player, hit frequency and payout spread over the `round` table.
+
+Against Supabase the database does the aggregation: the rtp_rollup function
+(migrations/0005_rtp_rollup.sql) returns one row per game with its totals, result counts, payout
+histogram and daily series. CSV exports, and databases without the function (--scan), are read
+as columnar NumPy chunks instead. Either way everything folds into fixed-size accumulators, so
+memory depends on the number of games and days, never on the number of rounds.
+
+    python rtp_analytics.py --since 2026-01-01 --json
+    python rtp_analytics.py --csv rounds.csv     # e.g. from psql: \\copy (select ...) to 'rounds.csv' csv header
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+RESULTS = ('win', 'loss', 'push', 'blackjack')
+RESULT_CODES = {name: i for i, name in enumerate(RESULTS)}
+ROUND_COLUMNS = 'round_id, game_id, points_used, points_change, round_result, played_at'
+
+# Net payout per point staked (points_change / points_used) is histogrammed on a fixed grid;
+# percentiles are read back from it, accurate to one bin width (0.005)
+MULTIPLIER_MIN = -5.0
+MULTIPLIER_MAX = 5.0
+MULTIPLIER_BINS = 2000
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+
+def chunk_from_rows(rows):
+    """Convert round dicts (PostgREST JSON or csv.DictReader rows) into columnar arrays.
+
+    Game ids become small integer codes into the chunk's own `games` mapping, so no later pass
+    has to sort or hash strings.
+    """
+    n = len(rows)
+    games = {}
+    return {
+        'game_code': np.fromiter((games.setdefault(str(r['game_id']), len(games)) for r in rows), dtype=np.int64, count=n),
+        'games': games,
+        'points_used': np.fromiter((int(r['points_used'] or 0) for r in rows), dtype=np.int64, count=n),
+        'points_change': np.fromiter((int(r['points_change'] or 0) for r in rows), dtype=np.int64, count=n),
+        'result': np.fromiter((RESULT_CODES.get(r['round_result'], -1) for r in rows), dtype=np.int8, count=n),
+        'day': np.array([str(r['played_at'])[:10] for r in rows], dtype='datetime64[D]'),
+    }
+
+
+def fetch_round_chunks(client, since=None, until=None, game_id=None, chunk_size=1000, execute=None):
+    """Yield columnar chunks of `round`, oldest first, paging on (played_at, round_id).
+
+    execute runs a query builder and returns its response; the app passes its deadline- and
+    breaker-aware wrapper, the CLI calls .execute() directly.
+    """
+    execute = execute or (lambda query: query.execute())
+    last = None
+    while True:
+        query = client.table('round').select(ROUND_COLUMNS)
+        if since:
+            query = query.gte('played_at', since)
+        if until:
+            query = query.lt('played_at', until)
+        if game_id:
+            query = query.eq('game_id', game_id)
+        if last:
+            played_at, round_id = last
+            query = query.or_(f'played_at.gt."{played_at}",and(played_at.eq."{played_at}",round_id.gt.{round_id})')
+        rows = execute(query.order('played_at').order('round_id').limit(chunk_size)).data or []
+        # PostgREST may cap pages below chunk_size, so only an empty page means done
+        if not rows:
+            return
+        yield chunk_from_rows(rows)
+        last = (rows[-1]['played_at'], rows[-1]['round_id'])
+
+
+CSV_COLUMNS = ('game_id', 'points_used', 'points_change', 'round_result', 'played_at')
+QUOTE, COMMA, CR, LF = b'"', b',', b'\r', b'\n'
+
+
+def _csv_fields(buf, starts, ends, width=None):
+    """The fields buf[starts:ends] as one fixed-width bytes array, surrounding quotes dropped."""
+    quoted = (ends - starts >= 2) & (buf[starts] == QUOTE[0])
+    starts = starts + quoted
+    lengths = ends - quoted - starts
+    width = width or max(int(lengths.max()), 1)
+    offsets = np.arange(width)
+    chars = np.take(buf, starts[:, None] + offsets, mode='clip')
+    chars[offsets >= lengths[:, None]] = 0  # NUL padding reads as end of string
+    return np.ascontiguousarray(chars).view(f'S{width}').ravel()
+
+
+def _csv_codes(values, names):
+    """Small integer codes for a bytes column, numbered in order of first appearance."""
+    uniques, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    for i in order.tolist():
+        names.setdefault(uniques[i].replace(QUOTE * 2, QUOTE).decode(), len(names))
+    return rank[inverse.ravel()]
+
+
+def _csv_delimiters(buf):
+    """Positions of the commas and newlines outside quotes, i.e. after an even number of quotes."""
+    quotes = np.flatnonzero(buf == QUOTE[0])
+    candidates = np.flatnonzero((buf == COMMA[0]) | (buf == LF[0]))
+    return candidates[(np.searchsorted(quotes, candidates) & 1) == 0]
+
+
+def _csv_block(buf, delims, index, width):
+    """Columnar chunk for a block of whole CSV lines held in a uint8 array."""
+    if len(delims) % width or not (buf[delims[width - 1::width]] == LF[0]).all():
+        raise ValueError(f"CSV rows do not all have {width} fields")
+    delims = delims.reshape(-1, width)
+    starts = np.empty_like(delims)
+    starts[:, 1:] = delims[:, :-1] + 1
+    starts[0, 0] = 0
+    starts[1:, 0] = delims[:-1, -1] + 1
+    ends = delims.copy()
+    ends[:, -1] -= buf[ends[:, -1] - 1] == CR[0]
+
+    def column(name, width=None):
+        return _csv_fields(buf, starts[:, index[name]], ends[:, index[name]], width)
+
+    def integers(name):
+        values = column(name)
+        values[values == b''] = b'0'
+        return values.astype(np.int64)
+
+    games, results = {}, {}
+    result_codes = _csv_codes(column('round_result'), results)
+    result_map = np.array([RESULT_CODES.get(name, -1) for name in results], dtype=np.int8)
+    return {
+        'game_code': _csv_codes(column('game_id'), games),
+        'games': games,
+        'points_used': integers('points_used'),
+        'points_change': integers('points_change'),
+        'result': result_map[result_codes],
+        # the first ten bytes of an ISO timestamp are its date
+        'day': column('played_at', 10).astype('datetime64[D]'),
+    }
+
+
+def csv_round_chunks(path, block_size=1 << 24):
+    """Yield columnar chunks from a CSV export with the ROUND_COLUMNS header (in any order).
+
+    The file is split into fields by NumPy a block at a time and only the needed columns are
+    converted, so no per-row or per-field Python objects are built.
+    """
+    with open(path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode()]), [])
+        missing = [c for c in CSV_COLUMNS if c not in header]
+        if missing:
+            raise ValueError(f"{path} lacks column(s) {', '.join(missing)}")
+        index = {name: header.index(name) for name in CSV_COLUMNS}
+        carry = b''
+        while True:
+            data = f.read(block_size)
+            block = carry + data
+            if not data:
+                if block.strip():
+                    buf = np.frombuffer(block if block.endswith(LF) else block + LF, dtype=np.uint8)
+                    yield _csv_block(buf, _csv_delimiters(buf), index, len(header))
+                return
+            buf = np.frombuffer(block, dtype=np.uint8)
+            delims = _csv_delimiters(buf)
+            lines = np.flatnonzero(buf[delims] == LF[0])
+            if not len(lines):
+                carry = block
+                continue
+            last = int(lines[-1])
+            cut = int(delims[last]) + 1
+            carry = block[cut:]
+            yield _csv_block(buf[:cut], delims[:last + 1], index, len(header))
+
+
+def fetch_rollup(client, since=None, until=None, game_id=None, page_size=1000, execute=None):
+    """Rows of the rtp_rollup function, one per game (paged only past PostgREST's row cap)."""
+    execute = execute or (lambda query: query.execute())
+    params = {
+        'since': since,
+        'until': until,
+        'game': game_id,
+        'mult_min': MULTIPLIER_MIN,
+        'mult_max': MULTIPLIER_MAX,
+        'bins': MULTIPLIER_BINS,
+    }
+    rows = []
+    while True:
+        page = execute(client.rpc('rtp_rollup', params).order('game_id').range(len(rows), len(rows) + page_size - 1)).data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+
+
+class RtpAccumulator:
+    """Running per-game and per-game-per-day totals, updated with one vectorized pass per chunk."""
+
+    def __init__(self):
+        self.game_ids = []
+        self._codes = {}
+        width = MULTIPLIER_BINS + 2  # plus underflow and overflow bins
+        self.rounds = np.zeros(0, dtype=np.int64)
+        self.wagered = np.zeros(0, dtype=np.float64)
+        self.net = np.zeros(0, dtype=np.float64)
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.mult_sum = np.zeros(0, dtype=np.float64)
+        self.mult_sumsq = np.zeros(0, dtype=np.float64)
+        self.results = np.zeros((0, len(RESULTS)), dtype=np.int64)
+        self.hist = np.zeros((0, width), dtype=np.int64)
+        self.daily = {}  # (game code, day) -> [rounds, wagered, net]
+
+    def _encode_games(self, chunk):
+        """Translate the chunk's local game codes into this accumulator's codes."""
+        lookup = np.zeros(len(chunk['games']), dtype=np.int64)
+        for gid, local in chunk['games'].items():
+            if gid not in self._codes:
+                self._codes[gid] = len(self.game_ids)
+                self.game_ids.append(gid)
+            lookup[local] = self._codes[gid]
+        self._grow(len(self.game_ids))
+        return lookup[chunk['game_code']]
+
+    def _grow(self, n):
+        extra = n - len(self.rounds)
+        if extra <= 0:
+            return
+        self.rounds = np.concatenate([self.rounds, np.zeros(extra, dtype=np.int64)])
+        self.wagered = np.concatenate([self.wagered, np.zeros(extra)])
+        self.net = np.concatenate([self.net, np.zeros(extra)])
+        self.hits = np.concatenate([self.hits, np.zeros(extra, dtype=np.int64)])
+        self.mult_sum = np.concatenate([self.mult_sum, np.zeros(extra)])
+        self.mult_sumsq = np.concatenate([self.mult_sumsq, np.zeros(extra)])
+        self.results = np.vstack([self.results, np.zeros((extra, len(RESULTS)), dtype=np.int64)])
+        self.hist = np.vstack([self.hist, np.zeros((extra, self.hist.shape[1]), dtype=np.int64)])
+
+    def add(self, chunk):
+        if not len(chunk['points_used']):
+            return
+        codes = self._encode_games(chunk)
+        used = chunk['points_used'].astype(np.float64)
+        change = chunk['points_change'].astype(np.float64)
+        n_games = len(self.game_ids)
+
+        self.rounds += np.bincount(codes, minlength=n_games)
+        self.wagered += np.bincount(codes, weights=used, minlength=n_games)
+        self.net += np.bincount(codes, weights=change, minlength=n_games)
+        self.hits += np.bincount(codes[change > 0], minlength=n_games)
+
+        known = chunk['result'] >= 0
+        flat = codes[known] * len(RESULTS) + chunk['result'][known]
+        self.results += np.bincount(flat, minlength=n_games * len(RESULTS)).reshape(n_games, len(RESULTS))
+
+        staked = used > 0
+        mult = change[staked] / used[staked]
+        mult_codes = codes[staked]
+        self.mult_sum += np.bincount(mult_codes, weights=mult, minlength=n_games)
+        self.mult_sumsq += np.bincount(mult_codes, weights=mult * mult, minlength=n_games)
+        width = self.hist.shape[1]
+        bins = np.floor((mult - MULTIPLIER_MIN) / (MULTIPLIER_MAX - MULTIPLIER_MIN) * MULTIPLIER_BINS).astype(np.int64) + 1
+        np.clip(bins, 0, width - 1, out=bins)
+        self.hist += np.bincount(mult_codes * width + bins, minlength=n_games * width).reshape(n_games, width)
+
+        days = chunk['day'].astype(np.int64)
+        keys = codes * (1 << 32) + (days - days.min())
+        uniques, inverse = np.unique(keys, return_inverse=True)
+        d_rounds = np.bincount(inverse)
+        d_wagered = np.bincount(inverse, weights=used)
+        d_net = np.bincount(inverse, weights=change)
+        base = days.min()
+        for key, r, w, n in zip(uniques.tolist(), d_rounds.tolist(), d_wagered.tolist(), d_net.tolist()):
+            slot = self.daily.setdefault((key >> 32, base + (key & 0xFFFFFFFF)), [0, 0.0, 0.0])
+            slot[0] += r
+            slot[1] += w
+            slot[2] += n
+
+    def add_rollup(self, rows):
+        """Fold rtp_rollup rows, one per game, into the same accumulators as add()."""
+        if not rows:
+            return
+        games = {}
+        game_code = np.fromiter((games.setdefault(str(r['game_id']), len(games)) for r in rows), dtype=np.int64, count=len(rows))
+        codes = self._encode_games({'games': games, 'game_code': game_code})
+        for code, r in zip(codes.tolist(), rows):
+            self.rounds[code] += int(r['rounds'] or 0)
+            self.wagered[code] += float(r['wagered'] or 0)
+            self.net[code] += float(r['net'] or 0)
+            self.hits[code] += int(r['hits'] or 0)
+            self.mult_sum[code] += float(r['mult_sum'] or 0)
+            self.mult_sumsq[code] += float(r['mult_sumsq'] or 0)
+            for result, n in (r['results'] or {}).items():
+                if result in RESULT_CODES:
+                    self.results[code, RESULT_CODES[result]] += int(n)
+            if r['bin_index']:
+                np.add.at(self.hist[code], np.asarray(r['bin_index'], dtype=np.int64), np.asarray(r['bin_rounds'], dtype=np.int64))
+            for day, n, w, net in zip(r['days'] or (), r['day_rounds'] or (), r['day_wagered'] or (), r['day_net'] or ()):
+                slot = self.daily.setdefault((code, int(np.datetime64(str(day)[:10], 'D').astype(np.int64))), [0, 0.0, 0.0])
+                slot[0] += int(n)
+                slot[1] += float(w)
+                slot[2] += float(net)
+
+    def _percentiles(self, hist_row):
+        total = hist_row.sum()
+        if not total:
+            return {}
+        cum = np.cumsum(hist_row)
+        width = (MULTIPLIER_MAX - MULTIPLIER_MIN) / MULTIPLIER_BINS
+        centers = np.concatenate([[MULTIPLIER_MIN], MULTIPLIER_MIN + (np.arange(MULTIPLIER_BINS) + 0.5) * width, [MULTIPLIER_MAX]])
+        idx = np.searchsorted(cum, np.array(PERCENTILES) / 100.0 * total)
+        return {f"p{p}": round(float(centers[min(i, len(centers) - 1)]), 4) for p, i in zip(PERCENTILES, idx)}
+
+    def report(self):
+        games = []
+        for code, gid in enumerate(self.game_ids):
+            rounds = int(self.rounds[code])
+            wagered = float(self.wagered[code])
+            returned = wagered + float(self.net[code])
+            staked = int(self.hist[code].sum())
+            mean = self.mult_sum[code] / staked if staked else 0.0
+            var = max(0.0, self.mult_sumsq[code] / staked - mean * mean) if staked else 0.0
+            rtp = returned / wagered if wagered else None
+            games.append({
+                "game_id": gid,
+                "rounds": rounds,
+                "wagered": wagered,
+                "returned": returned,
+                "rtp": rtp,
+                "house_edge": (1 - rtp) if rtp is not None else None,
+                "hit_frequency": int(self.hits[code]) / rounds if rounds else None,
+                "results": {name: int(c) for name, c in zip(RESULTS, self.results[code])},
+                "multiplier": {"mean": float(mean), "std": float(np.sqrt(var)), **self._percentiles(self.hist[code])},
+            })
+        daily = [{
+            "game_id": self.game_ids[code],
+            "day": str(np.datetime64(int(day), 'D')),
+            "rounds": r,
+            "wagered": w,
+            "rtp": (w + n) / w if w else None,
+        } for (code, day), (r, w, n) in sorted(self.daily.items())]
+        return {"games": games, "daily": daily}
+
+
+def compute_rtp(chunks):
+    """Fold an iterable of columnar chunks into the per-game / per-day report."""
+    acc = RtpAccumulator()
+    for chunk in chunks:
+        acc.add(chunk)
+    return acc.report()
+
+
+def compute_rtp_rollup(rows):
+    """The same report from rtp_rollup rows."""
+    acc = RtpAccumulator()
+    acc.add_rollup(rows)
+    return acc.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-game RTP and payout analytics over the round table")
+    parser.add_argument('--since', help="played_at lower bound (inclusive), e.g. 2026-01-01")
+    parser.add_argument('--until', help="played_at upper bound (exclusive)")
+    parser.add_argument('--game-id', help="restrict to one game")
+    parser.add_argument('--csv', help="read rounds from a CSV export instead of Supabase")
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--scan', action='store_true', help="page through every round instead of calling rtp_rollup")
+    parser.add_argument('--json', action='store_true', help="print the full report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.csv:
+        report = compute_rtp(csv_round_chunks(args.csv))
+    else:
+        from dotenv import load_dotenv
+        from supabase import create_client
+        load_dotenv()
+        url = os.getenv('SUPABASE_URL')
+        key = os.getenv('SUPABASE_SERVICE_ROLE_KEY') or os.getenv('SUPABASE_KEY')
+        if not url or not key:
+            parser.error("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY (or SUPABASE_KEY) must be set, or pass --csv")
+        client = create_client(url, key)
+        if args.scan:
+            report = compute_rtp(fetch_round_chunks(client, args.since, args.until, args.game_id, args.chunk_size))
+        else:
+            report = compute_rtp_rollup(fetch_rollup(client, args.since, args.until, args.game_id))
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    print(f"{'game_id':38} {'rounds':>10} {'rtp':>8} {'edge':>8} {'hit%':>7} {'p5':>7} {'p50':>7} {'p95':>7}")
+    for g in report['games']:
+        m = g['multiplier']
+        print(f"{g['game_id']:38} {g['rounds']:>10} {g['rtp'] or 0:>8.4f} {g['house_edge'] or 0:>8.4f} "
+              f"{(g['hit_frequency'] or 0) * 100:>6.2f}% {m.get('p5', 0):>7.3f} {m.get('p50', 0):>7.3f} {m.get('p95', 0):>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""Synthetic users, rounds and point transactions at production scale, for performance work.
+
+Activity has a realistic shape: a heavy-tailed number of rounds per user, bets on multiples of
+the game minimum, blackjack outcomes played out by blackjack_sim, evening peaks in play time, and
+balance_after following each user's rounds (clamped at zero as the API does). Rows are written in
+chunked bulk operations to one of:
+
+    --target supabase   auth users through the admin API in parallel, then bulk PostgREST writes
+    --target postgres   the local stand-in (migrations/local_schema.sql) via COPY; needs psycopg 3
+    --target csv        one CSV per table in --out, for \\copy or rtp_analytics.py --csv round.csv
+
+    python seed_dataset.py --target postgres --dsn postgresql://localhost/placebo --users 100000 --rounds 5000000
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from uuid import UUID
+
+import numpy as np
+
+from blackjack_sim import DEFAULT_RULES, LOSS, PUSH, WIN, BLACKJACK, play_hands
+
+START_POINTS = 1000
+EMAIL_DOMAIN = 'seed.placebo.test'
+# Share of play per hour of day (UTC), peaking in the evening
+HOURLY_WEIGHTS = np.array([3, 2, 1, 1, 1, 1, 1, 2, 3, 3, 4, 4, 5, 5, 5, 5, 6, 7, 8, 9, 10, 10, 8, 5], dtype=float)
+# Typical stake per user as a multiple of the game's minimum bet
+BET_MULTIPLES = np.array([1, 2, 5, 10, 25, 50])
+BET_MULTIPLE_WEIGHTS = np.array([0.35, 0.25, 0.2, 0.1, 0.07, 0.03])
+RESULT_NAMES = {LOSS: 'loss', PUSH: 'push', WIN: 'win', BLACKJACK: 'win'}  # the client reports naturals as 'win'
+TRANSACTION_TYPES = {'win': 'GAME_WIN', 'loss': 'GAME_LOSS', 'push': 'GAME_PUSH'}
+
+USER_COLUMNS = ('user_id', 'username', 'email', 'created_at')
+PROFILE_COLUMNS = ('user_id', 'username', 'current_points', 'user_status', 'created_at', 'updated_at')
+ROUND_COLUMNS = ('round_id', 'user_id', 'game_id', 'points_used', 'round_result', 'points_change', 'balance_after', 'round_data', 'played_at')
+TRANSACTION_COLUMNS = ('transaction_id', 'user_id', 'transaction_type', 'transaction_change', 'balance_after', 'round_id', 'description', 'created_at')
+
+
+_HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+_UUID_HEX_POSITIONS = [i for i in range(36) if i not in (8, 13, 18, 23)]
+
+
+def _uuids(rng, n):
+    """n random version-4 UUID strings, formatted in bulk rather than one uuid.UUID at a time."""
+    raw = np.frombuffer(rng.bytes(16 * n), dtype=np.uint8).reshape(n, 16).copy()
+    raw[:, 6] = raw[:, 6] & 0x0F | 0x40
+    raw[:, 8] = raw[:, 8] & 0x3F | 0x80
+    nibbles = np.empty((n, 32), dtype=np.uint8)
+    nibbles[:, 0::2] = raw >> 4
+    nibbles[:, 1::2] = raw & 0x0F
+    chars = np.full((n, 36), ord('-'), dtype=np.uint8)
+    chars[:, _UUID_HEX_POSITIONS] = _HEX_DIGITS[nibbles]
+    return chars.view('S36').ravel().astype('U36').tolist()
+
+
+def _timestamps(epoch_seconds):
+    return np.datetime_as_string((epoch_seconds * 1e6).astype('datetime64[us]'), unit='us', timezone='UTC').tolist()
+
+
+def reflected_balances(user_codes, changes, start):
+    """balance_after for each round, where balance = max(0, balance + change) per user.
+
+    Rows must be grouped by user in play order. The clamped walk equals the running total minus
+    its running minimum below zero; offsetting each group keeps the running minimum from
+    leaking across users.
+    """
+    if not len(changes):
+        return changes
+    starts = np.nonzero(np.r_[True, user_codes[1:] != user_codes[:-1]])[0]
+    sizes = np.diff(np.r_[starts, len(changes)])
+    group = np.repeat(np.arange(len(starts)), sizes)
+    totals = np.cumsum(changes)
+    totals = totals - np.repeat(np.r_[0, totals[starts[1:] - 1]], sizes) + start
+    spread = 2 * (int(np.abs(totals).max()) + 1)
+    running_min = np.minimum.accumulate(totals - group * spread) + group * spread
+    return totals - np.minimum(running_min, 0)
+
+
+def evening_times(rng, start, end, hour_p, max_passes=50):
+    """One timestamp per element of start, in [start, end), with hour of day drawn from hour_p.
+
+    Each draw takes a uniform day in the window and a weighted hour within it; draws that land
+    outside the window (on its first or last day) are drawn again rather than clipped, which
+    would pile rounds onto the window edges. Stragglers after max_passes are drawn uniformly.
+    """
+    played = np.empty(len(start))
+    todo = np.arange(len(start))
+    for _ in range(max_passes):
+        if not len(todo):
+            return played
+        day = np.floor((start[todo] + rng.random(len(todo)) * (end - start[todo])) / 86400)
+        played[todo] = day * 86400 + rng.choice(24, len(todo), p=hour_p) * 3600 + rng.random(len(todo)) * 3600
+        todo = todo[(played[todo] < start[todo]) | (played[todo] >= end)]
+    played[todo] = start[todo] + rng.random(len(todo)) * (end - start[todo])
+    return played
+
+
+def generate(rng, n_users, n_rounds, days, game_id, min_bet, prefix, batch_users):
+    """Yield (users, profiles, rounds, transactions) row batches covering n_users and n_rounds."""
+    end = time.time()
+    begin = end - days * 86400
+    activity = rng.lognormal(0.0, 1.5, n_users)
+    rounds_per_user = rng.multinomial(n_rounds, activity / activity.sum())
+    hour_p = HOURLY_WEIGHTS / HOURLY_WEIGHTS.sum()
+
+    for first in range(0, n_users, batch_users):
+        counts = rounds_per_user[first:first + batch_users]
+        n = len(counts)
+        user_ids = _uuids(rng, n)
+        joined = rng.uniform(begin, end - 3600, n)
+
+        # Rounds: spread between sign-up and now, concentrated in the evening
+        owner = np.repeat(np.arange(n), counts)
+        total = len(owner)
+        played = evening_times(rng, joined[owner], end, hour_p)
+        order = np.lexsort((played, owner))
+        owner, played = owner[order], played[order]
+
+        stake = min_bet * rng.choice(BET_MULTIPLES, n, p=BET_MULTIPLE_WEIGHTS)
+        bets = np.maximum(min_bet, (stake[owner] * rng.choice([0.5, 1.0, 1.0, 1.0, 2.0], total)) // min_bet * min_bet).astype(np.int64)
+        outcome = play_hands(rng, total, DEFAULT_RULES)
+        change = np.select([outcome == LOSS, outcome == PUSH, outcome == WIN],
+                           [-bets, 0, bets], (bets * DEFAULT_RULES['payout']).astype(np.int64))
+        balance = reflected_balances(owner, change, START_POINTS)
+
+        final = np.full(n, START_POINTS, dtype=np.int64)
+        if total:
+            last = np.r_[owner[1:] != owner[:-1], True]
+            final[owner[last]] = balance[last]
+
+        joined_at = _timestamps(joined)
+        now = datetime.now(timezone.utc).isoformat()
+        names = [f"{prefix}{first + i:07d}" for i in range(n)]
+        users = [(uid, name, f"{name}@{EMAIL_DOMAIN}", at) for uid, name, at in zip(user_ids, names, joined_at)]
+        profiles = [(uid, name, int(points), 'active', at, now) for uid, name, points, at in zip(user_ids, names, final.tolist(), joined_at)]
+
+        rounds = []
+        transactions = []
+        for rid, tid, uidx, bet, code, pc, bal, at in zip(_uuids(rng, total), _uuids(rng, total), owner.tolist(), bets.tolist(),
+                                                          outcome.tolist(), change.tolist(), balance.tolist(), _timestamps(played)):
+            uid = user_ids[uidx]
+            result = RESULT_NAMES[code]
+            rounds.append((rid, uid, game_id, bet, result, pc, bal, f'{{"bet": {bet}}}', at))
+            transactions.append((tid, uid, TRANSACTION_TYPES[result], pc, bal, rid, f'{result.capitalize()} - {bet} points bet', at))
+        yield users, profiles, rounds, transactions
+
+
+class _CsvTarget:
+    def __init__(self, out):
+        os.makedirs(out, exist_ok=True)
+        self.out = out
+        self._started = set()
+
+    def game(self, game_id):
+        game_id = game_id or str(UUID(bytes=os.urandom(16), version=4))
+        self.write('game', ('game_id', 'game_name', 'game_type', 'game_status', 'min_bet_points'),
+                   [(game_id, 'Blackjack', 'blackjack', 'waiting', 10)])
+        return game_id, 10
+
+    def users(self, users, password):
+        self.write('users', USER_COLUMNS, users)
+
+    def write(self, table, columns, rows):
+        path = os.path.join(self.out, f'{table}.csv')
+        with open(path, 'a' if table in self._started else 'w', newline='') as f:
+            writer = csv.writer(f)
+            if table not in self._started:
+                writer.writerow(columns)
+                self._started.add(table)
+            writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class _PostgresTarget:
+    def __init__(self, dsn):
+        import psycopg
+        self.conn = psycopg.connect(dsn)
+
+    def game(self, game_id):
+        with self.conn.cursor() as cur:
+            if game_id:
+                cur.execute("select game_id, min_bet_points from game where game_id = %s", (game_id,))
+            else:
+                cur.execute("select game_id, min_bet_points from game where game_type = 'blackjack' limit 1")
+            row = cur.fetchone()
+        if not row:
+            raise SystemExit("No blackjack game row; apply migrations/local_schema.sql first")
+        return str(row[0]), row[1] or 10
+
+    def users(self, users, password):
+        self.write('auth.users', ('id', 'email', 'raw_user_meta_data', 'created_at'),
+                   [(uid, email, json.dumps({'username': name, 'display_name': name}), at) for uid, name, email, at in users])
+
+    def write(self, table, columns, rows):
+        with self.conn.cursor() as cur:
+            with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class _SupabaseTarget:
+    def __init__(self, chunk_size, concurrency):
+        from dotenv import load_dotenv
+        from supabase import create_client
+        from postgrest.types import ReturnMethod
+        load_dotenv()
+        url = os.getenv('SUPABASE_URL')
+        key = os.getenv('SUPABASE_SERVICE_ROLE_KEY') or os.getenv('SUPABASE_KEY')
+        if not url or not key:
+            raise SystemExit("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set for --target supabase")
+        self.client = create_client(url, key)
+        self.returning = ReturnMethod.minimal
+        self.chunk_size = chunk_size
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    def game(self, game_id):
+        query = self.client.table('game').select('game_id, min_bet_points')
+        query = query.eq('game_id', game_id) if game_id else query.eq('game_type', 'blackjack')
+        rows = query.limit(1).execute().data
+        if not rows:
+            raise SystemExit("No blackjack game row in Supabase; pass --game-id")
+        return rows[0]['game_id'], rows[0].get('min_bet_points') or 10
+
+    def users(self, users, password):
+        def create(user):
+            uid, name, email, _ = user
+            self.client.auth.admin.create_user({
+                "id": uid,
+                "email": email,
+                "password": password,
+                "email_confirm": True,
+                "user_metadata": {"username": name, "display_name": name}
+            })
+        list(self.pool.map(create, users))
+
+    def write(self, table, columns, rows):
+        # Profiles already exist (created by the sign-up trigger), so they are upserted
+        on_conflict = 'user_id' if table == 'user_profile' else None
+
+        def send(start):
+            payload = [dict(zip(columns, row)) for row in rows[start:start + self.chunk_size]]
+            for item in payload:
+                if 'round_data' in item:
+                    item['round_data'] = json.loads(item['round_data'])
+            query = self.client.table(table)
+            query = query.upsert(payload, on_conflict=on_conflict) if on_conflict else query.insert(payload, returning=self.returning)
+            query.execute()
+        list(self.pool.map(send, range(0, len(rows), self.chunk_size)))
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic production-sized dataset")
+    parser.add_argument('--target', choices=('supabase', 'postgres', 'csv'), required=True)
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'), help="postgres target connection string")
+    parser.add_argument('--out', default='dataset', help="csv target directory")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=90, help="history length")
+    parser.add_argument('--game-id', help="game for all rounds (default: the blackjack game)")
+    parser.add_argument('--prefix', default='seed', help="username prefix; change it to seed again into the same database")
+    parser.add_argument('--password', default='seed-password', help="password for every generated user")
+    parser.add_argument('--batch-users', type=int, default=5000, help="users generated and written per batch")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="rows per PostgREST insert")
+    parser.add_argument('--concurrency', type=int, default=8, help="parallel Supabase requests")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    if args.users < 1 or args.rounds < 0:
+        parser.error("--users must be positive and --rounds non-negative")
+
+    if args.target == 'csv':
+        target = _CsvTarget(args.out)
+    elif args.target == 'postgres':
+        if not args.dsn:
+            parser.error("--dsn or DATABASE_URL is required for --target postgres")
+        target = _PostgresTarget(args.dsn)
+    else:
+        target = _SupabaseTarget(args.chunk_size, args.concurrency)
+
+    rng = np.random.default_rng(args.seed)
+    game_id, min_bet = target.game(args.game_id)
+    began = time.perf_counter()
+    written = 0
+    try:
+        for users, profiles, rounds, transactions in generate(rng, args.users, args.rounds, args.days, game_id,
+                                                              min_bet, args.prefix, args.batch_users):
+            target.users(users, args.password)
+            target.write('user_profile', PROFILE_COLUMNS, profiles)
+            target.write('round', ROUND_COLUMNS, rounds)
+            target.write('point_transaction', TRANSACTION_COLUMNS, transactions)
+            written += len(rounds)
+            elapsed = time.perf_counter() - began
+            print(f"{written}/{args.rounds} rounds, {elapsed:.0f}s ({written / elapsed:,.0f} rounds/s)", file=sys.stderr)
+    finally:
+        target.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -50,6 +50,31 @@ function getAuthHeaders(): Record<string, string> {
   };
 }
 
+// Writes carry an Idempotency-Key that stays the same across retries, so a retry after a dropped
+// connection (or while the first attempt is still running, 409) gets the original response
+// instead of applying the write twice. The server only answers 503 to a keyed write when nothing
+// was written and the key was released; a failure after a write keeps the key with a 500, which
+// is never retried. A replayed response is final either way.
+const WRITE_RETRIES = 2;
+
+async function fetchWrite(url: string, init: RequestInit): Promise<Response> {
+  const headers = { ...(init.headers as Record<string, string>), 'Idempotency-Key': crypto.randomUUID() };
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const response = await fetch(url, { ...init, headers });
+      const retryable = response.status === 409 || (response.status === 503 && !response.headers.get('Idempotent-Replayed'));
+      if (!retryable || attempt >= WRITE_RETRIES) {
+        return response;
+      }
+    } catch (error) {
+      if (attempt >= WRITE_RETRIES) {
+        throw error;
+      }
+    }
+    await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+  }
+}
+
 export interface LoginResponse {
   success: boolean;
   user: {
@@ -226,7 +251,7 @@ export const casinoAPI = {
         throw new Error('Not logged in');
       }
 
-      const response = await fetch(`${API_BASE_URL}/user/${userId}/points`, {
+      const response = await fetchWrite(`${API_BASE_URL}/user/${userId}/points`, {
         method: 'PUT',
         headers: getAuthHeaders(),
         body: JSON.stringify({ 
@@ -278,7 +303,7 @@ export const casinoAPI = {
         }
       }
 
-      const response = await fetch(`${API_BASE_URL}/game/round`, {
+      const response = await fetchWrite(`${API_BASE_URL}/game/round`, {
         method: 'POST',
         headers: getAuthHeaders(),
         body: JSON.stringify({
@@ -363,7 +388,7 @@ export const casinoAPI = {
 
   async generateRewardCode(points: number, uses: number = 1): Promise<{ code: string; points: number }> {
     try {
-      const response = await fetch(`${API_BASE_URL}/rewards/generate`, {
+      const response = await fetchWrite(`${API_BASE_URL}/rewards/generate`, {
         method: 'POST',
         headers: getAuthHeaders(),
         body: JSON.stringify({ points, uses }),
@@ -388,7 +413,7 @@ export const casinoAPI = {
         throw new Error('Not logged in');
       }
 
-      const response = await fetch(`${API_BASE_URL}/rewards/redeem`, {
+      const response = await fetchWrite(`${API_BASE_URL}/rewards/redeem`, {
         method: 'POST',
         headers: getAuthHeaders(),
         body: JSON.stringify({ user_id: userId, code: code.toUpperCase() }),